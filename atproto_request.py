@@ -0,0 +1,55 @@
+import httpx
+from atproto_client.exceptions import RequestErrorBase
+from atproto_client.request import AsyncRequest, Request, RequestBase
+
+from retry import host_of, note_rate_limit
+
+# Kept apart from http_client so that only runs which talk to Bluesky import atproto
+
+
+def _note(url, response):
+    if response is not None:
+        note_rate_limit(host_of(url), response.headers)
+
+
+class SharedRequest(Request):
+    """atproto request handler that goes through our pooled client"""
+
+    def __init__(self, http_client: httpx.Client):
+        # Skip Request.__init__, which would open a private httpx.Client
+        RequestBase.__init__(self)
+        self._client = http_client
+
+    def _send_request(self, method, url, **kwargs):
+        # Rate-limit headers come with successes and errors alike
+        try:
+            response = super()._send_request(method, url, **kwargs)
+        except RequestErrorBase as e:
+            _note(url, e.response)
+            raise
+        _note(url, response)
+        return response
+
+    def close(self):
+        # The pool outlives any single atproto Client
+        pass
+
+
+class SharedAsyncRequest(AsyncRequest):
+    """atproto async request handler that goes through our pooled client"""
+
+    def __init__(self, http_client: httpx.AsyncClient):
+        RequestBase.__init__(self)
+        self._client = http_client
+
+    async def _send_request(self, method, url, **kwargs):
+        try:
+            response = await super()._send_request(method, url, **kwargs)
+        except RequestErrorBase as e:
+            _note(url, e.response)
+            raise
+        _note(url, response)
+        return response
+
+    async def close(self):
+        pass
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import functools
+import typing as t
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, timedelta
+
+from http_client import get_http_client
+from lexicon import DAY_TEMPLATE_FAMILIES, LEXICON_PATH, parse_day_template, store_entries
+from retry import get_with_retry
+from wiktionary_query import day_entry_titles, page_wikitexts, wikitext_params
+
+logger = logging.getLogger(__name__)
+
+# Titles per query allowed to regular accounts
+BATCH_SIZE = 50
+
+
+def _days(start: date, end: date) -> t.Iterator[date]:
+    while start <= end:
+        yield start
+        start += timedelta(days=1)
+
+
+def _fetch_batch(http, api_url: str, titles: t.List[str]) -> t.Dict[str, str]:
+    response = get_with_retry(http, api_url, params=wikitext_params(titles))
+    return page_wikitexts(response.json(), titles)
+
+
+def backfill(families: t.Sequence[str], start: date, end: date, api_url: str, dbname: str,
+             store: t.Optional[str] = LEXICON_PATH, workers: int = 4, processes: t.Optional[int] = None,
+             batch_size: int = BATCH_SIZE, language: str = "fr") -> t.Dict[str, t.Any]:
+    """Resolve the day templates of a date range, write them to the lexicon and report the gaps
+
+    language is the edition's, whose templates the definitions are rendered with.
+    """
+    http = get_http_client()
+    candidates = {
+        (family, day): day_entry_titles(family, day)
+        for family in families for day in _days(start, end)
+    }
+    titles = sorted({title for day_titles in candidates.values() for title in day_titles})
+    batches = [titles[i:i + batch_size] for i in range(0, len(titles), batch_size)]
+
+    started = time.perf_counter()
+    wikitexts: t.Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for found in pool.map(lambda batch: _fetch_batch(http, api_url, batch), batches):
+            wikitexts.update(found)
+    fetched = time.perf_counter()
+
+    # Parsing is CPU-bound, it gets its own processes
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        parse = functools.partial(parse_day_template, language=language)
+        parsed = dict(zip(wikitexts, pool.map(parse, wikitexts.values(), chunksize=16)))
+    finished = time.perf_counter()
+
+    report = {"days": len(candidates), "titles": len(titles), "requests": len(batches),
+              "missing": [], "unparseable": [], "resolved": {}}
+    rows = []
+    for (family, day), day_titles in candidates.items():
+        key = f"{family}/{day.isoformat()}"
+        existing = [title for title in day_titles if title in wikitexts]
+        if not existing:
+            report["missing"].append(key)
+            continue
+        # In order of preference, like get_today_word
+        title = existing[0]
+        if parsed[title] is None:
+            report["unparseable"].append(title)
+            continue
+        report["resolved"][key] = title
+        rows.append((title, "", parsed[title]))
+
+    if store and rows:
+        store_entries(rows, dbname, store)
+
+    report["fetch_seconds"] = round(fetched - started, 3)
+    report["parse_seconds"] = round(finished - fetched, 3)
+    report["titles_per_second"] = round(len(titles) / max(finished - started, 1e-9), 1)
+    return report
+
+
+def main(argv=None):
+    today = date.today()
+    parser = argparse.ArgumentParser(description="Resolve the day templates of a date range in batched requests")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(today.year, 1, 1))
+    parser.add_argument("--end", type=date.fromisoformat, default=date(today.year, 12, 31))
+    parser.add_argument("--family", action="append", help="template family, both series by default")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent API requests")
+    parser.add_argument("--processes", type=int, help="parsing processes, one per CPU by default")
+    parser.add_argument("--store", default=LEXICON_PATH, help="lexicon to write the entries to")
+    parser.add_argument("--no-store", action="store_true", help="only report")
+    parser.add_argument("--json", help="write the full report to this file")
+    args = parser.parse_args(argv)
+
+    from oneshot import configure
+
+    configure()
+    language = os.getenv("WIKTIONARY_LANGUAGE", "fr")
+    site_url = os.getenv("WIKTIONARY_BASE_URL", f"https://{language}.wiktionary.org")
+
+    report = backfill(args.family or DAY_TEMPLATE_FAMILIES, args.start, args.end, f"{site_url}/w/api.php",
+                      f"{language}wiktionary", store=None if args.no_store else args.store,
+                      workers=args.workers, processes=args.processes, language=language)
+
+    print(f"{report['days']} days, {len(report['resolved'])} resolved, {len(report['missing'])} missing, "
+          f"{len(report['unparseable'])} unparseable")
+    print(f"{report['titles']} titles in {report['requests']} requests: fetch {report['fetch_seconds']} s, "
+          f"parse {report['parse_seconds']} s, {report['titles_per_second']} titles/s")
+    for key in report["missing"]:
+        print(f"MISSING {key}")
+    for title in report["unparseable"]:
+        print(f"UNPARSEABLE {title}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Compare the extracts and wikitext backends; run from the repository root with python -m bench.compare_backends"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import contextlib
+import tempfile
+import typing as t
+
+from bench.run_benchmarks import _point_at, percentile
+from bench.standins import StandIn
+
+
+def bench_backend(backend: str, iterations: int) -> t.Dict[str, t.Any]:
+    """Bytes fetched and parse time of today's entry with one backend, nothing cached between iterations"""
+    from metrics import get_metrics
+    from word_cache import WordDataCache
+    from wiktionary_bluesky_bot import WiktionaryBlueskyBot
+
+    fetch, parse, sizes = [], [], []
+    for i in range(iterations):
+        cache_path = os.path.join(os.environ["DATA_DIR"], f"word_cache_{backend}_{i}.json")
+        bot = WiktionaryBlueskyBot(backend=backend, word_cache=WordDataCache(cache_path), name=backend)
+        # Bytes as received, counted by the metered HTTP client
+        key = (backend, "get_today_word", "in")
+        before = get_metrics()._bytes[key]
+
+        start = time.perf_counter()
+        page_name = bot.get_today_word()
+        fetch.append(time.perf_counter() - start)
+        sizes.append(get_metrics()._bytes[key] - before)
+        if page_name is None:
+            raise RuntimeError(f"The {backend} backend found no entry for today")
+
+        source, _ = bot._day_extracts.pop(page_name)
+        start = time.perf_counter()
+        word_data = bot._parse_extract(source)
+        parse.append(time.perf_counter() - start)
+        if not word_data:
+            raise RuntimeError(f"The {backend} backend could not parse <{page_name}>")
+    return {
+        "bytes": sizes[-1],
+        "fetch_p50_ms": percentile(fetch, 50) * 1000,
+        "parse_p50_ms": percentile(parse, 50) * 1000,
+        "parse_p95_ms": percentile(parse, 95) * 1000,
+        "word_data": word_data,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bytes and parse time of the extracts and wikitext backends")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--site-url", help="compare on this Wiktionary edition rather than the stand-in")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    with contextlib.ExitStack() as stack:
+        data_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        if args.site_url:
+            os.environ["WIKTIONARY_LANGUAGE"] = "fr"
+            os.environ["WIKTIONARY_BASE_URL"] = args.site_url
+            os.environ["DATA_DIR"] = data_dir
+        else:
+            _point_at(stack.enter_context(StandIn()).base_url, data_dir)
+        # Keep log I/O out of the numbers
+        logging.disable(logging.WARNING)
+        report = {backend: bench_backend(backend, args.iterations) for backend in ("extracts", "wikitext")}
+
+    print(f"{'backend':<12}{'bytes':>10}{'fetch p50 ms':>15}{'parse p50 ms':>15}{'parse p95 ms':>15}")
+    for backend, numbers in report.items():
+        print(f"{backend:<12}{numbers['bytes']:>10}{numbers['fetch_p50_ms']:>15.2f}"
+              f"{numbers['parse_p50_ms']:>15.2f}{numbers['parse_p95_ms']:>15.2f}")
+    same = report["extracts"]["word_data"] == report["wikitext"]["word_data"]
+    print("word_data identical" if same else "word_data DIFFERS between backends")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import tempfile
+import typing as t
+
+from bench.standins import HANDLE, StandIn
+
+# Stages timed for each bot, in pipeline order
+STAGES = ("get_today_word", "get_word_data", "get_og_tags", "post_to_bluesky")
+
+
+def percentile(samples: t.List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def _point_at(base_url: str, data_dir: str):
+    # Read by the bot modules at import time, so this runs before importing them
+    os.environ["WIKTIONARY_LANGUAGE"] = "fr"
+    os.environ["WIKTIONARY_BASE_URL"] = base_url
+    os.environ["BLUESKY_PDS_URL"] = base_url
+    os.environ["BLUESKY_HANDLE"] = HANDLE
+    os.environ["BLUESKY_PASSWORD"] = "bench"
+    os.environ["DATA_DIR"] = data_dir
+    # The stand-in is one host for Wiktionary and the PDS, and the numbers are the bot's, not the rate limiter's
+    os.environ["WIKTIONARY_RATE"] = "0"
+
+
+def bench_bot(bot_class, iterations: int, stand_in: StandIn) -> t.Dict[str, t.List[float]]:
+    """Time every stage of a bot, with a fresh instance, post log and outbox per iteration"""
+    timings = {stage: [] for stage in STAGES}
+    from posted_words import PostedWords
+    from outbox import Outbox
+
+    for i in range(iterations):
+        # The stand-in always serves the same word, which would count as a repost,
+        # and the same day, whose record key the PDS and the outbox would find already used
+        stand_in.records.clear()
+        log_path = os.path.join(os.environ["DATA_DIR"], f"posted_words_{bot_class.__name__}_{i}.log")
+        outbox_path = os.path.join(os.environ["DATA_DIR"], f"outbox_{bot_class.__name__}_{i}.sqlite")
+        bot = bot_class(posted_words=PostedWords(log_path, seed_path=None), outbox=Outbox(outbox_path))
+        if not bot.connect_to_bluesky():
+            raise RuntimeError("Stand-in PDS refused the login")
+
+        start = time.perf_counter()
+        page_name = bot.get_today_word()
+        timings["get_today_word"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        word_data = bot.get_word_data(page_name)
+        timings["get_word_data"].append(time.perf_counter() - start)
+        if not word_data:
+            raise RuntimeError(f"{bot_class.__name__} could not parse <{page_name}>")
+
+        start = time.perf_counter()
+        bot.get_og_tags(word_data["url"])
+        timings["get_og_tags"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        if not bot.post_to_bluesky(word_data):
+            raise RuntimeError(f"{bot_class.__name__} failed to post")
+        timings["post_to_bluesky"].append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings: t.Dict[str, t.List[float]]) -> t.Dict[str, t.Dict[str, float]]:
+    return {
+        stage: {"p50_ms": percentile(samples, 50) * 1000, "p95_ms": percentile(samples, 95) * 1000}
+        for stage, samples in timings.items()
+    }
+
+
+def regressions(report, baseline, tolerance: float, min_delta_ms: float) -> t.List[str]:
+    """Stages whose p95 grew by more than tolerance (e.g. 0.2 for +20 %) and min_delta_ms over the baseline"""
+    found = []
+    for bot_name, stages in report["bots"].items():
+        for stage, numbers in stages.items():
+            before = baseline.get("bots", {}).get(bot_name, {}).get(stage)
+            if not before or numbers["p95_ms"] - before["p95_ms"] < min_delta_ms:
+                continue
+            if numbers["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                found.append(f"{bot_name}.{stage}: p95 {before['p95_ms']:.1f} ms -> {numbers['p95_ms']:.1f} ms")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline per-stage benchmark of both bots")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every stand-in response")
+    parser.add_argument("--page-kb", type=int, default=300, help="size of the stand-in article body")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="report to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore smaller p95 differences")
+    args = parser.parse_args(argv)
+
+    with StandIn(latency=args.latency, page_kb=args.page_kb) as stand_in, tempfile.TemporaryDirectory() as data_dir:
+        _point_at(stand_in.base_url, data_dir)
+        from wiktionary_bluesky_bot import WiktionaryBlueskyBot
+        from wiktionary_stranger import WiktionayStranger
+        # Keep log I/O out of the numbers
+        logging.disable(logging.WARNING)
+
+        report = {"latency_s": args.latency, "iterations": args.iterations, "bots": {}}
+        for bot_class in (WiktionaryBlueskyBot, WiktionayStranger):
+            report["bots"][bot_class.__name__] = summarize(bench_bot(bot_class, args.iterations, stand_in))
+        report["requests"] = dict(stand_in.requests)
+        report["bytes_served"] = stand_in.bytes_sent
+
+    print(f"{'stage':<40}{'p50 ms':>10}{'p95 ms':>10}")
+    for bot_name, stages in report["bots"].items():
+        for stage, numbers in stages.items():
+            print(f"{bot_name + '.' + stage:<40}{numbers['p50_ms']:>10.1f}{numbers['p95_ms']:>10.1f}")
+    print(f"{report['bytes_served']} bytes served over {sum(report['requests'].values())} requests")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(report, json.load(f), args.tolerance, args.min_delta_ms)
+        for line in found:
+            print(f"REGRESSION {line}")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
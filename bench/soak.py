@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+import multiprocessing
+import typing as t
+
+from bench.run_benchmarks import _point_at, percentile
+from bench.standins import StandIn
+from clock import VirtualClock, set_clock
+
+DAY = 24 * 3600
+
+
+def _serve(conn, options: t.Dict[str, t.Any]):
+    """Stand-in in a process of its own, so that its memory, threads and sockets are not counted as the scheduler's"""
+    with StandIn(**options) as stand_in:
+        conn.send(stand_in.base_url)
+        # Serves until told to stop
+        conn.recv()
+
+
+def rss_kb() -> int:
+    """Resident set size of this process"""
+    with open("/proc/self/status", encoding="ascii") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def open_descriptors() -> t.Tuple[int, int]:
+    """(file descriptors, of which sockets) open in this process"""
+    fds = sockets = 0
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            target = os.readlink(f"/proc/self/fd/{fd}")
+        except OSError:
+            # The descriptor listdir itself used
+            continue
+        fds += 1
+        sockets += target.startswith("socket:")
+    return fds, sockets
+
+
+class SoakClock(VirtualClock):
+    """Virtual clock that samples the process at every midnight and stops the scheduler after the last day"""
+
+    def __init__(self, start: float, days: int, on_day: t.Callable[[int], None]):
+        super().__init__(start)
+        self.start = start
+        self.days = days
+        self.on_day = on_day
+        self._day = 0
+
+    def wait(self, event, seconds: float) -> bool:
+        super().wait(event, seconds)
+        day = int((self.time() - self.start) // DAY)
+        if day > self._day:
+            self._day = day
+            self.on_day(day)
+            if day >= self.days:
+                event.set()
+        return event.is_set()
+
+
+class Recorder:
+    """Daily samples of memory, descriptors and run latency, with tracemalloc snapshots after the warm-up and at the end
+
+    Only two snapshots are kept: they are traced allocations too, and would read as growth.
+    """
+
+    def __init__(self, warmup_days: int, days: int):
+        # Taken after the day's sample: the first one is in every sample the trends are drawn from
+        self.snapshot_days = (warmup_days, days)
+        self.samples: t.List[t.Dict[str, t.Any]] = []
+        self.snapshots: t.List[tracemalloc.Snapshot] = []
+        self._seen_runs: t.Dict[str, float] = {}
+
+    def _new_run_latencies(self) -> t.Dict[str, float]:
+        from metrics import get_metrics
+
+        latencies = {}
+        for bot, run in get_metrics().last_runs.items():
+            if run["timestamp"] != self._seen_runs.get(bot):
+                self._seen_runs[bot] = run["timestamp"]
+                latencies[bot] = run["duration_s"]
+        return latencies
+
+    def on_day(self, day: int):
+        fds, sockets = open_descriptors()
+        self.samples.append({
+            "day": day,
+            "rss_kb": rss_kb(),
+            "traced_kb": tracemalloc.get_traced_memory()[0] // 1024,
+            "fds": fds,
+            "sockets": sockets,
+            "runs_s": self._new_run_latencies(),
+        })
+        if day in self.snapshot_days:
+            self.snapshots.append(tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))))
+
+
+def growth(samples: t.List[t.Dict[str, t.Any]], key: str) -> float:
+    """Growth of a sampled value over the samples, from a least-squares line so that noise does not count"""
+    days = [sample["day"] for sample in samples]
+    values = [sample[key] for sample in samples]
+    if len(set(days)) < 2 or len(set(values)) < 2:
+        return 0.0
+    slope, _ = statistics.linear_regression(days, values)
+    return slope * (days[-1] - days[0])
+
+
+def latency_growth(samples: t.List[t.Dict[str, t.Any]]) -> t.Dict[str, t.Tuple[float, float]]:
+    """(median of the first half, median of the second half) of each feed's run durations, in seconds"""
+    runs: t.Dict[str, t.List[float]] = {}
+    for sample in samples:
+        for bot, duration in sample["runs_s"].items():
+            runs.setdefault(bot, []).append(duration)
+    halves = {}
+    for bot, durations in runs.items():
+        if len(durations) >= 4:
+            middle = len(durations) // 2
+            halves[bot] = (statistics.median(durations[:middle]), statistics.median(durations[middle:]))
+    return halves
+
+
+def verdict(samples, args) -> t.List[str]:
+    """What grew past its tolerance after the warm-up days"""
+    steady = [sample for sample in samples if sample["day"] > args.warmup_days]
+    found = []
+    for key, tolerance, unit in (("rss_kb", args.max_rss_growth_mb * 1024, "kB"),
+                                 ("traced_kb", args.max_traced_growth_mb * 1024, "kB"),
+                                 ("fds", args.max_fd_growth, ""), ("sockets", args.max_fd_growth, "")):
+        grew = growth(steady, key)
+        if grew > tolerance:
+            found.append(f"{key} grew by {grew:.1f}{unit} over days {steady[0]['day']}-{steady[-1]['day']}")
+    for bot, (before, after) in latency_growth(steady).items():
+        if after > before * (1 + args.max_latency_growth) and (after - before) * 1000 > args.min_latency_delta_ms:
+            found.append(f"{bot} runs went from {before * 1000:.1f} ms to {after * 1000:.1f} ms (median)")
+    return found
+
+
+def top_growth(recorder: Recorder, limit: int = 10) -> t.List[str]:
+    """Source lines whose allocations grew the most between the end of the warm-up and the last day"""
+    if len(recorder.snapshots) < 2:
+        return []
+    stats = recorder.snapshots[-1].compare_to(recorder.snapshots[0], "lineno")
+    return [str(stat) for stat in stats[:limit] if stat.size_diff > 0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the scheduler through simulated days against local stand-ins")
+    parser.add_argument("--days", type=int, default=200)
+    parser.add_argument("--warmup-days", type=int, default=14, help="days left out of the trends, caches fill up")
+    parser.add_argument("--jobs", help="SCHEDULER_JOBS for the run, the scheduler's default otherwise")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every stand-in response")
+    parser.add_argument("--page-kb", type=int, default=20, help="size of the stand-in article body")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=8.0)
+    parser.add_argument("--max-traced-growth-mb", type=float, default=2.0)
+    parser.add_argument("--max-fd-growth", type=float, default=1.0, help="for file descriptors and sockets")
+    parser.add_argument("--max-latency-growth", type=float, default=0.5, help="e.g. 0.5 for +50 %%")
+    parser.add_argument("--min-latency-delta-ms", type=float, default=5.0, help="ignore smaller latency differences")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="write the daily samples and the verdict to this file")
+    args = parser.parse_args(argv)
+
+    conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=_serve, daemon=True, args=(
+        child_conn, {"latency": args.latency, "page_kb": args.page_kb, "daily_words": True}))
+    server.start()
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            _point_at(conn.recv(), data_dir)
+            os.environ.update({"METRICS_PORT": "0", "POSTED_WORDS_SEED": "", "LOG_LEVEL": args.log_level})
+            if args.jobs:
+                os.environ["SCHEDULER_JOBS"] = args.jobs
+            # scheduler.log goes with the rest of the data
+            os.chdir(data_dir)
+
+            recorder = Recorder(args.warmup_days, args.days)
+            # Starts with the process' own allocations, so that imports do not read as growth
+            tracemalloc.start()
+            soak_clock = SoakClock(time.time(), args.days, recorder.on_day)
+            set_clock(soak_clock)
+            import scheduler
+
+            started = time.perf_counter()
+            scheduler.main()
+            elapsed = time.perf_counter() - started
+            tracemalloc.stop()
+    finally:
+        os.chdir(cwd)
+        conn.send(None)
+        server.join(5)
+
+    samples = recorder.samples
+    found = verdict(samples, args)
+    first = next((sample for sample in samples if sample["day"] > args.warmup_days), samples[0])
+    last = samples[-1]
+    print(f"{len(samples)} simulated days in {elapsed:.1f} s")
+    print(f"{'':<12}{'day ' + str(first['day']):>12}{'day ' + str(last['day']):>12}")
+    for key in ("rss_kb", "traced_kb", "fds", "sockets"):
+        print(f"{key:<12}{first[key]:>12}{last[key]:>12}")
+    durations = [duration for sample in samples for duration in sample["runs_s"].values()]
+    if durations:
+        print(f"runs: p50 {percentile(durations, 50) * 1000:.1f} ms, p95 {percentile(durations, 95) * 1000:.1f} ms")
+    for line in top_growth(recorder):
+        print(f"  {line}")
+    for line in found:
+        print(f"GROWTH {line}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"elapsed_s": elapsed, "samples": samples, "growth": found}, f, indent=2)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+import typing as t
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+HANDLE = "bench.bsky.test"
+DID = "did:plc:benchstandin0000000000"
+
+
+def _read_fixture(name, mode="r"):
+    with open(os.path.join(FIXTURES_DIR, name), mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+        return f.read()
+
+
+def _b64(payload: t.Dict[str, t.Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).rstrip(b"=").decode()
+
+
+def fake_jwt(scope: str, lifetime: int) -> str:
+    """Unsigned JWT with the claims atproto reads (it never checks the signature client-side)"""
+    now = int(time.time())
+    header = _b64({"typ": "at+jwt", "alg": "ES256K"})
+    payload = _b64({"scope": scope, "sub": DID, "iat": now, "exp": now + lifetime})
+    return f"{header}.{payload}.c2lnbmF0dXJl"
+
+
+class StandIn:
+    """One HTTP server playing both Wiktionary and the PDS, with a configurable latency"""
+
+    def __init__(self, latency: float = 0.0, page_kb: int = 300, current_year_entries: bool = False,
+                 daily_words: bool = False):
+        self.latency = latency
+        self.page_kb = page_kb
+        # When False only the 2021 fallback templates exist, like most days in practice
+        self.current_year_entries = current_year_entries
+        # When True each day template has a word of its own, so that days in a row all get posted
+        self.daily_words = daily_words
+        self.requests = Counter()
+        self.bytes_sent = 0
+        self.records: t.List[t.Dict[str, t.Any]] = []
+        # Writes left in the PDS rate-limit window, None for no limit (and no RateLimit-* headers)
+        self.rate_limit: t.Optional[int] = None
+        self.rate_limit_window = 60
+        # createRecord or applyWrites calls whose records are written but whose response is lost (answered 502)
+        self.lost_create_responses = 0
+        self._lock = threading.Lock()
+
+        self._extract = _read_fixture("extract_entree_du_jour.html")
+        self._wikitext = _read_fixture("entree_du_jour.wikitext")
+        self._article = _read_fixture("article.html")
+        self._thumb = _read_fixture("thumb.png", "rb")
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        stand_in = self
+
+        class Handler(_Handler):
+            owner = stand_in
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Wiktionary
+
+    def _page_for(self, title: str, prop: str) -> t.Dict[str, t.Any]:
+        if title.startswith("Modèle:"):
+            year = title.split("/")[1] if "/" in title else ""
+            if year != "2021" and (not self.current_year_entries or year != str(datetime.now().year)):
+                return {"ns": 10, "title": title, "missing": True}
+            # Older templates were created first
+            page = {"pageid": 1000 + int(year), "ns": 10, "title": title}
+        else:
+            page = {"pageid": 2000 + len(title), "ns": 0, "title": title}
+        props = prop.split("|")
+        if "info" in props:
+            page["lastrevid"] = 30000000 + page["pageid"]
+        if "revisions" in props:
+            page["revisions"] = [{"slots": {"main": {"contentmodel": "wikitext",
+                                                     "content": self._word_of(title, self._wikitext)}}}]
+        if "extracts" in props:
+            page["extract"] = self._word_of(title, self._extract)
+        return page
+
+    def _word_of(self, title: str, fixture: str) -> str:
+        if not self.daily_words or title.count("/") < 3:
+            return fixture
+        month, day = title.split("/")[2:4]
+        return fixture.replace("douanier", f"douanier-{month}-{day}")
+
+    def api(self, params: t.Dict[str, str]) -> t.Dict[str, t.Any]:
+        titles = params.get("titles", "").split("|")
+        prop = params.get("prop", "extracts")
+        response = {"batchcomplete": True, "query": {"pages": [self._page_for(title, prop) for title in titles]}}
+        if len(titles) > 1 and "extracts" in prop.split("|") and not params.get("exintro"):
+            # Like TextExtracts: whole-page extracts come one per request, for the lowest page id
+            pages = sorted((page for page in response["query"]["pages"] if "extract" in page),
+                           key=lambda page: page["pageid"])
+            for page in pages[1:]:
+                del page["extract"]
+            response["warnings"] = {"extracts": {"warnings": '"exlimit" was too large for a whole article extracts '
+                                                             'request, lowered to 1.'}}
+        return response
+
+    def article(self) -> str:
+        filler = "<p>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 16 + "</p>\n"
+        body = filler * max(1, self.page_kb * 1024 // len(filler))
+        return self._article.replace("{base_url}", self.base_url).replace("{body}", body)
+
+    # PDS
+
+    def session(self) -> t.Dict[str, t.Any]:
+        return {
+            "did": DID,
+            "handle": HANDLE,
+            "accessJwt": fake_jwt("com.atproto.access", 2 * 3600),
+            "refreshJwt": fake_jwt("com.atproto.refresh", 60 * 24 * 3600),
+        }
+
+    def upload_blob(self, data: bytes, mime_type: str) -> t.Dict[str, t.Any]:
+        # Any well-formed CID will do, clients treat it as opaque
+        digest = hashlib.sha256(data).digest()
+        cid = "b" + base64.b32encode(b"\x01\x55\x12\x20" + digest).decode().lower().rstrip("=")
+        return {"blob": {"$type": "blob", "ref": {"$link": cid}, "mimeType": mime_type, "size": len(data)}}
+
+    def create_record(self, body: t.Dict[str, t.Any]) -> t.Tuple[int, t.Dict[str, t.Any]]:
+        with self._lock:
+            rkey = body.get("rkey") or f"3k{len(self.records) + 1:011d}"
+            if any(record.get("rkey") == rkey for record in self.records):
+                return 400, {"error": "InvalidRequest", "message": f"Record already exists: {rkey}"}
+            self.records.append(dict(body, rkey=rkey))
+            if self.lost_create_responses:
+                self.lost_create_responses -= 1
+                return 502, {"error": "UpstreamFailure", "message": "Bad gateway"}
+        return 200, {
+            "uri": f"at://{DID}/{body.get('collection')}/{rkey}",
+            "cid": "bafyreie5737gdxlw5i64vzichcalba3z2v5n6icifvx5xytvske7mr3hpm",
+        }
+
+    def apply_writes(self, body: t.Dict[str, t.Any]) -> t.Tuple[int, t.Dict[str, t.Any]]:
+        """Creates only, all written or none like a real commit"""
+        with self._lock:
+            writes = body.get("writes", [])
+            taken = {record.get("rkey") for record in self.records}
+            for write in writes:
+                if write.get("rkey") in taken:
+                    return 400, {"error": "InvalidRequest", "message": f"Record already exists: {write['rkey']}"}
+            for write in writes:
+                self.records.append({"repo": body.get("repo"), "collection": write["collection"],
+                                     "rkey": write["rkey"], "record": write["value"]})
+            if self.lost_create_responses:
+                self.lost_create_responses -= 1
+                return 502, {"error": "UpstreamFailure", "message": "Bad gateway"}
+        return 200, {}
+
+    def get_record(self, params: t.Dict[str, str]) -> t.Tuple[int, t.Dict[str, t.Any]]:
+        with self._lock:
+            for record in self.records:
+                if record.get("rkey") == params.get("rkey") and record.get("collection") == params.get("collection"):
+                    uri = f"at://{DID}/{record['collection']}/{record['rkey']}"
+                    return 200, {"uri": uri, "cid": "bafyreie5737gdxlw5i64vzichcalba3z2v5n6icifvx5xytvske7mr3hpm",
+                                 "value": record["record"]}
+        return 400, {"error": "RecordNotFound", "message": "Could not locate record"}
+
+    def rate_limit_headers(self, write: bool) -> t.Tuple[bool, t.Dict[str, str]]:
+        """(allowed, RateLimit-* headers) of a PDS call, writes using up the window"""
+        with self._lock:
+            if self.rate_limit is None:
+                return True, {}
+            allowed = not write or self.rate_limit > 0
+            if write and allowed:
+                self.rate_limit -= 1
+            reset = int(time.time()) + self.rate_limit_window
+            return allowed, {"RateLimit-Limit": "100", "RateLimit-Remaining": str(self.rate_limit),
+                             "RateLimit-Reset": str(reset), "RateLimit-Policy": f"100;w={self.rate_limit_window}"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; Nagle would hold the body back
+    disable_nagle_algorithm = True
+    owner: StandIn
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: t.Optional[t.Dict[str, str]] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients that only read <head> hang up early
+            self.close_connection = True
+            return
+        with self.owner._lock:
+            self.owner.bytes_sent += len(body)
+
+    def _json(self, payload: t.Dict[str, t.Any], status: int = 200, headers: t.Optional[t.Dict[str, str]] = None):
+        self._send(status, json.dumps(payload).encode(), "application/json; charset=utf-8", headers)
+
+    def _route(self, method: str):
+        owner = self.owner
+        if owner.latency:
+            time.sleep(owner.latency)
+        url = urlsplit(self.path)
+        with owner._lock:
+            owner.requests[f"{method} {url.path}"] += 1
+        body = b""
+        if method == "POST":
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        if url.path == "/w/api.php":
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            return self._json(owner.api(params))
+        if url.path.startswith("/wiki/"):
+            return self._send(200, owner.article().encode(), "text/html; charset=UTF-8")
+        if url.path == "/static/thumb.png":
+            return self._send(200, owner._thumb, "image/png")
+
+        nsid = unquote(url.path).rsplit("/", 1)[-1]
+        allowed, headers = owner.rate_limit_headers(
+            write=nsid in ("com.atproto.repo.createRecord", "com.atproto.repo.applyWrites"))
+        if not allowed:
+            return self._json({"error": "RateLimitExceeded", "message": "Rate Limit Exceeded"}, 429, headers)
+        if nsid == "com.atproto.repo.getRecord":
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            status, payload = owner.get_record(params)
+            return self._json(payload, status, headers)
+        if nsid in ("com.atproto.server.createSession", "com.atproto.server.refreshSession"):
+            return self._json(owner.session())
+        if nsid in ("com.atproto.server.getSession", "app.bsky.actor.getProfile"):
+            return self._json({"did": DID, "handle": HANDLE})
+        if nsid == "com.atproto.repo.uploadBlob":
+            return self._json(owner.upload_blob(body, self.headers.get("Content-Type", "application/octet-stream")))
+        if nsid == "com.atproto.repo.createRecord":
+            status, payload = owner.create_record(json.loads(body))
+            return self._json(payload, status, headers)
+        if nsid == "com.atproto.repo.applyWrites":
+            status, payload = owner.apply_writes(json.loads(body))
+            return self._json(payload, status, headers)
+        return self._json({"error": "MethodNotImplemented", "message": nsid}, status=501)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
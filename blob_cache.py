@@ -0,0 +1,175 @@
+import io
+import os
+import json
+import hashlib
+import logging
+import threading
+import typing as t
+
+from bluesky_session import PDS_HOST
+from retry import async_call_with_retry, call_with_retry
+
+if t.TYPE_CHECKING:
+    from atproto_client.models.blob_ref import BlobRef
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+
+# Largest thumbnail a PDS accepts for a link card
+MAX_BLOB_BYTES = int(os.getenv("BLUESKY_MAX_BLOB_BYTES", "1000000"))
+# Largest og:image we agree to download before giving up on it
+MAX_DOWNLOAD_BYTES = int(os.getenv("THUMB_MAX_DOWNLOAD_BYTES", "10000000"))
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def _check_declared_size(response, cap):
+    declared = response.headers.get("content-length")
+    if declared and int(declared) > cap:
+        raise ImageTooLarge(f"Image declares {declared} bytes, cap is {cap}")
+
+
+def download_image(http_client, url, cap=MAX_DOWNLOAD_BYTES) -> bytes:
+    """Stream an image into memory, aborting as soon as it exceeds cap bytes"""
+    with http_client.stream("GET", url) as response:
+        response.raise_for_status()
+        _check_declared_size(response, cap)
+        buffer = bytearray()
+        for chunk in response.iter_bytes():
+            buffer += chunk
+            if len(buffer) > cap:
+                raise ImageTooLarge(f"Image is larger than {cap} bytes")
+        return bytes(buffer)
+
+
+async def async_download_image(http_client, url, cap=MAX_DOWNLOAD_BYTES) -> bytes:
+    """Async counterpart of download_image"""
+    async with http_client.stream("GET", url) as response:
+        response.raise_for_status()
+        _check_declared_size(response, cap)
+        buffer = bytearray()
+        async for chunk in response.aiter_bytes():
+            buffer += chunk
+            if len(buffer) > cap:
+                raise ImageTooLarge(f"Image is larger than {cap} bytes")
+        return bytes(buffer)
+
+
+def fit_blob_limit(data: bytes, limit=MAX_BLOB_BYTES) -> t.Optional[bytes]:
+    """Downscale/recompress an image to fit the PDS limit, None if it cannot be done"""
+    if len(data) <= limit:
+        return data
+
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.error("Thumbnail is over the blob limit and Pillow is not installed")
+        return None
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = image.convert("RGB")
+        side = max(image.size)
+        for max_side in (2000, 1500, 1000, 700, 500):
+            if max_side < side:
+                image.thumbnail((max_side, max_side))
+            for quality in (85, 70, 55):
+                out = io.BytesIO()
+                image.save(out, format="JPEG", quality=quality, optimize=True)
+                if out.tell() <= limit:
+                    logger.info("Thumbnail recompressed from %d to %d bytes", len(data), out.tell())
+                    return out.getvalue()
+    except Exception as e:
+        logger.error("Failed to recompress the thumbnail: %s", e)
+        return None
+
+    logger.error("Thumbnail still over %d bytes after recompression", limit)
+    return None
+
+
+class BlobCache:
+    """Blob references already uploaded, keyed by account DID and image content hash"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DATA_DIR, "blobs.json")
+        self._lock = threading.Lock()
+        self._entries: t.Dict[str, t.Dict[str, t.Any]] = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error("Ignoring unreadable blob cache %s: %s", self.path, e)
+
+    @staticmethod
+    def _key(did, data: bytes):
+        return f"{did}:{hashlib.sha256(data).hexdigest()}"
+
+    def get(self, did, data: bytes) -> t.Optional["BlobRef"]:
+        from atproto_client.models.blob_ref import BlobRef
+
+        entry = self._entries.get(self._key(did, data))
+        if entry is None:
+            return None
+        return BlobRef.model_validate(entry)
+
+    def put(self, did, data: bytes, blob: "BlobRef"):
+        """Record a blob once a post references it (unreferenced blobs are garbage collected by the PDS)"""
+        entry = blob.model_dump(by_alias=True)
+        with self._lock:
+            key = self._key(did, data)
+            if self._entries.get(key) == entry:
+                return
+            self._entries[key] = entry
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._entries, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                # Still cached for the life of the process
+                logger.error("Failed to write the blob cache: %s", e)
+
+
+_default_cache = None
+
+
+def get_blob_cache() -> BlobCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = BlobCache()
+    return _default_cache
+
+
+def upload_thumb(client, data: bytes, cache: BlobCache) -> t.Optional["BlobRef"]:
+    """Return the known blob of a thumbnail, uploading it (fitted to the blob limit) if needed"""
+    did = client.me.did
+    blob = cache.get(did, data)
+    if blob is not None:
+        logger.info("Thumbnail already uploaded, reusing its blob")
+        return blob
+
+    payload = fit_blob_limit(data)
+    if payload is None:
+        return None
+    # Uploads are content-addressed, retrying one cannot duplicate anything
+    return call_with_retry(client.upload_blob, payload, host=PDS_HOST).blob
+
+
+async def async_upload_thumb(client, data: bytes, cache: BlobCache) -> t.Optional["BlobRef"]:
+    """Async counterpart of upload_thumb"""
+    did = client.me.did
+    blob = cache.get(did, data)
+    if blob is not None:
+        logger.info("Thumbnail already uploaded, reusing its blob")
+        return blob
+
+    payload = fit_blob_limit(data)
+    if payload is None:
+        return None
+    return (await async_call_with_retry(client.upload_blob, payload, host=PDS_HOST)).blob
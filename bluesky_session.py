@@ -0,0 +1,197 @@
+import os
+import re
+import asyncio
+import logging
+import threading
+import typing as t
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+if t.TYPE_CHECKING:
+    from atproto import AsyncClient, Client, Session
+
+# atproto and its models take most of a cold start; they are imported on the first login only
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+# PDS to talk to, bsky.social when unset
+PDS_URL = os.getenv("BLUESKY_PDS_URL")
+# Key of the PDS circuit breaker
+PDS_HOST = urlsplit(PDS_URL).hostname if PDS_URL else "bsky.social"
+
+
+class SessionStore:
+    """Bluesky session strings (handle, DID, access and refresh JWTs), one file per account"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(DATA_DIR, "sessions")
+
+    def _path(self, handle):
+        return os.path.join(self.directory, re.sub(r"[^\w.-]+", "_", handle) + ".session")
+
+    def load(self, handle) -> t.Optional[str]:
+        try:
+            with open(self._path(handle), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def save(self, handle, session_string: str):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(handle)
+        tmp_path = f"{path}.tmp"
+        # The session grants full access to the account, keep it private
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(session_string)
+        os.replace(tmp_path, path)
+
+    def delete(self, handle):
+        try:
+            os.remove(self._path(handle))
+        except FileNotFoundError:
+            pass
+
+
+def _refresh_token_usable(session_string: str) -> bool:
+    """False when the stored refresh JWT has expired (or cannot be read)"""
+    from atproto import Session
+    from atproto_server.auth.jwt import get_jwt_payload
+
+    try:
+        refresh_jwt = Session.decode(session_string).refresh_jwt
+        exp = get_jwt_payload(refresh_jwt).exp
+        return exp is None or datetime.fromtimestamp(exp, timezone.utc) > datetime.now(timezone.utc)
+    except Exception:
+        return False
+
+
+def _save_session(store: SessionStore, handle, session: "Session"):
+    # A read-only data volume must not turn a successful login into a failure
+    try:
+        store.save(handle, session.export())
+    except OSError as e:
+        logger.error("Failed to store the Bluesky session for %s: %s", handle, e)
+
+
+# Logged-in clients by (handle, pool), reused by every bot and run of the process
+_clients: t.Dict[t.Tuple[str, int], t.Any] = {}
+# Only guards the dicts: logins run under the lock of their account
+_clients_lock = threading.Lock()
+_logins: t.Dict[str, threading.Lock] = {}
+_async_logins: t.Dict[str, asyncio.Lock] = {}
+
+_default_store = None
+
+
+def get_session_store() -> SessionStore:
+    global _default_store
+    if _default_store is None:
+        _default_store = SessionStore()
+    return _default_store
+
+
+def get_bluesky_client(handle, password, http_client, store: t.Optional[SessionStore] = None) -> "Client":
+    """Return a logged-in client, reusing the live one, then the stored session, then the password"""
+    from atproto import Client, Session, SessionEvent
+    from atproto_request import SharedRequest
+
+    store = store or get_session_store()
+    key = (handle, id(http_client))
+    with _clients_lock:
+        if key in _clients:
+            return _clients[key]
+        login_lock = _logins.setdefault(handle, threading.Lock())
+
+    # Logging in takes a few round trips to the PDS: only the logins of the same account wait for each other
+    with login_lock:
+        with _clients_lock:
+            if key in _clients:
+                return _clients[key]
+
+        client = Client(PDS_URL, request=SharedRequest(http_client))
+
+        def on_session_change(event: SessionEvent, session: Session):
+            # Refreshed tokens are written back so the next process starts from them
+            if event in (SessionEvent.CREATE, SessionEvent.REFRESH):
+                _save_session(store, handle, session)
+
+        client.on_session_change(on_session_change)
+
+        session_string = store.load(handle)
+        logged_in = False
+        if session_string and _refresh_token_usable(session_string):
+            try:
+                # Refreshes the access JWT on its own when it has expired
+                client.login(session_string=session_string)
+                logged_in = True
+                logger.info("Resumed stored Bluesky session for %s", handle)
+            except Exception as e:
+                logger.error("Stored Bluesky session for %s rejected: %s", handle, e)
+                store.delete(handle)
+
+        if not logged_in:
+            client.login(handle, password)
+            logger.info("Created a new Bluesky session for %s", handle)
+
+        with _clients_lock:
+            _clients[key] = client
+        return client
+
+
+async def get_async_bluesky_client(handle, password, http_client,
+                                   store: t.Optional[SessionStore] = None) -> "AsyncClient":
+    """Async counterpart of get_bluesky_client, sharing the same stored sessions"""
+    key = (handle, id(http_client))
+    with _clients_lock:
+        if key in _clients:
+            return _clients[key]
+        login_lock = _async_logins.setdefault(handle, asyncio.Lock())
+    # Feeds of one account starting at once wait for a single login
+    async with login_lock:
+        with _clients_lock:
+            if key in _clients:
+                return _clients[key]
+        client = await _async_login(handle, password, http_client, store or get_session_store())
+        with _clients_lock:
+            _clients[key] = client
+        return client
+
+
+async def _async_login(handle, password, http_client, store: SessionStore) -> "AsyncClient":
+    from atproto import AsyncClient, Session, SessionEvent
+    from atproto_request import SharedAsyncRequest
+
+    client = AsyncClient(PDS_URL, request=SharedAsyncRequest(http_client))
+
+    async def on_session_change(event: SessionEvent, session: Session):
+        if event in (SessionEvent.CREATE, SessionEvent.REFRESH):
+            _save_session(store, handle, session)
+
+    client.on_session_change(on_session_change)
+
+    session_string = store.load(handle)
+    logged_in = False
+    if session_string and _refresh_token_usable(session_string):
+        try:
+            await client.login(session_string=session_string)
+            logged_in = True
+            logger.info("Resumed stored Bluesky session for %s", handle)
+        except Exception as e:
+            logger.error("Stored Bluesky session for %s rejected: %s", handle, e)
+            store.delete(handle)
+
+    if not logged_in:
+        await client.login(handle, password)
+        logger.info("Created a new Bluesky session for %s", handle)
+
+    return client
+
+
+def forget_bluesky_client(handle, http_client=None):
+    """Drop the live clients of an account (on one pool only if given), e.g. after its session was revoked"""
+    with _clients_lock:
+        for key in [key for key in _clients if key[0] == handle]:
+            if http_client is None or key[1] == id(http_client):
+                del _clients[key]
@@ -0,0 +1,69 @@
+import time as _time
+import threading
+import typing as t
+from datetime import date, datetime, tzinfo
+
+
+class Clock:
+    """The wall clock the scheduler and the bots read their day and time from"""
+
+    def time(self) -> float:
+        return _time.time()
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        """Wait for event at most seconds, return whether it is set"""
+        return event.wait(seconds)
+
+
+class VirtualClock(Clock):
+    """A clock that only moves when waited on, so that days go by in no time"""
+
+    def __init__(self, start: float):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        with self._lock:
+            return self._now
+
+    def advance(self, seconds: float):
+        with self._lock:
+            self._now += max(0.0, seconds)
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        if not event.is_set():
+            self.advance(seconds)
+        return event.is_set()
+
+
+_clock = Clock()
+
+
+def set_clock(clock: Clock):
+    """Make every reader of the time use clock, such as a VirtualClock for a soak test"""
+    global _clock
+    _clock = clock
+
+
+def get_clock() -> Clock:
+    return _clock
+
+
+def time() -> float:
+    """Epoch seconds, like time.time()"""
+    return _clock.time()
+
+
+def now(tz: t.Optional[tzinfo] = None) -> datetime:
+    """Current time, like datetime.now(tz)"""
+    return datetime.fromtimestamp(_clock.time(), tz)
+
+
+def today() -> date:
+    """Local date, like date.today()"""
+    return now().date()
+
+
+def wait(event: threading.Event, seconds: float) -> bool:
+    """Wait for event at most seconds, like event.wait(seconds)"""
+    return _clock.wait(event, seconds)
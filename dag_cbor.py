@@ -0,0 +1,65 @@
+import base64
+import hashlib
+import struct
+import typing as t
+
+# CIDv1, dag-cbor codec, sha2-256 multihash of 32 bytes
+_CID_PREFIX = b"\x01\x71\x12\x20"
+_CID_TAG = 42
+
+
+def _head(major: int, value: int) -> bytes:
+    if value < 24:
+        return bytes([major << 5 | value])
+    for info, fmt in ((24, ">B"), (25, ">H"), (26, ">I"), (27, ">Q")):
+        if value < 1 << (8 * struct.calcsize(fmt)):
+            return bytes([major << 5 | info]) + struct.pack(fmt, value)
+    raise ValueError(f"Integer too large for CBOR: {value}")
+
+
+def _cid_bytes(cid: str) -> bytes:
+    if not cid.startswith("b"):
+        raise ValueError(f"Only base32 CIDs are supported: {cid}")
+    encoded = cid[1:].upper()
+    return base64.b32decode(encoded + "=" * (-len(encoded) % 8))
+
+
+def encode(value: t.Any) -> bytes:
+    """DAG-CBOR of a record in its JSON form, {"$link": ...} and {"$bytes": ...} included
+
+    Unlike libipld's encoder, a plain string stays a string even when it reads as a CID,
+    as the strong refs of replies must.
+    """
+    if value is None:
+        return b"\xf6"
+    if value is True:
+        return b"\xf5"
+    if value is False:
+        return b"\xf4"
+    if isinstance(value, int):
+        return _head(0, value) if value >= 0 else _head(1, -1 - value)
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        return _head(3, len(data)) + data
+    if isinstance(value, bytes):
+        return _head(2, len(value)) + value
+    if isinstance(value, (list, tuple)):
+        return _head(4, len(value)) + b"".join(encode(item) for item in value)
+    if isinstance(value, dict):
+        if value.keys() == {"$link"}:
+            link = b"\x00" + _cid_bytes(value["$link"])
+            return _head(6, _CID_TAG) + _head(2, len(link)) + link
+        if value.keys() == {"$bytes"}:
+            return encode(base64.b64decode(value["$bytes"] + "=" * (-len(value["$bytes"]) % 4)))
+        # Canonical order: shorter keys first, then bytewise
+        keys = sorted((key.encode("utf-8") for key in value), key=lambda key: (len(key), key))
+        return _head(5, len(keys)) + b"".join(
+            _head(3, len(key)) + key + encode(value[key.decode("utf-8")]) for key in keys)
+    # Floats are not allowed in atproto records
+    raise TypeError(f"Cannot encode {type(value).__name__} in a record")
+
+
+def record_cid(record: t.Dict[str, t.Any]) -> str:
+    """CID the PDS will give a record, known before it is written"""
+    digest = hashlib.sha256(encode(record)).digest()
+    return "b" + base64.b32encode(_CID_PREFIX + digest).decode("ascii").lower().rstrip("=")
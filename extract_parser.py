@@ -0,0 +1,216 @@
+import logging
+import typing as t
+from html.parser import HTMLParser
+
+logger = logging.getLogger(__name__)
+
+# Elements that never get an end tag
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+# Extract HTML is fed to the parser this many characters at a time
+CHUNK_SIZE = 4096
+
+
+class _Definition:
+    """Text of one definition, final once its first line is known"""
+
+    def __init__(self):
+        self.parts: t.List[str] = []
+        self.done = False
+
+    def add(self, data):
+        if self.done:
+            return
+        self.parts.append(data)
+        text = "".join(self.parts).lstrip()
+        if "\n" in text:
+            # Only the first line of a definition is posted
+            self.parts = [text.split("\n")[0]]
+            self.done = True
+
+    def first_line(self):
+        return "".join(self.parts).strip().split("\n")[0]
+
+
+class _ExtractParser(HTMLParser):
+    """Collects the first paragraph, its first <span>, and the items of the first <ol>"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.events: t.List[t.Tuple[str, str]] = []
+        self._stack: t.List[str] = []
+
+        self._p_depth = None
+        self._p_parts: t.List[str] = []
+        self._span_depth = None
+        self._span_parts: t.List[str] = []
+        self._title_seen = False
+        self._first_line_seen = False
+
+        self._ol_depth = None
+        self._ol_done = False
+        self._open: t.List[t.Tuple[int, _Definition]] = []
+        self._pending: t.List[_Definition] = []
+
+    def handle_starttag(self, tag, attrs):
+        parent = self._stack[-1] if self._stack else None
+        if tag not in _VOID_TAGS:
+            self._stack.append(tag)
+        depth = len(self._stack)
+
+        if tag == "p" and self._p_depth is None and not self._first_line_seen:
+            self._p_depth = depth
+        elif tag == "span" and self._p_depth is not None and self._span_depth is None and not self._title_seen:
+            self._span_depth = depth
+        elif tag == "ol" and self._ol_depth is None and not self._ol_done:
+            self._ol_depth = depth
+        elif tag == "li" and self._ol_depth is not None and parent == "ol":
+            definition = _Definition()
+            self._open.append((depth, definition))
+            self._pending.append(definition)
+
+    def handle_endtag(self, tag):
+        if tag not in self._stack:
+            return
+        # Close everything left open inside this element, like a forgiving HTML parser would
+        while self._stack:
+            depth = len(self._stack)
+            closed = self._stack.pop()
+            self._close(closed, depth)
+            if closed == tag:
+                break
+        self._flush_definitions()
+
+    def _close(self, tag, depth):
+        if depth == self._span_depth:
+            self._span_depth = None
+            self._title_seen = True
+            self.events.append(("title", "".join(self._span_parts)))
+        if depth == self._p_depth:
+            self._p_depth = None
+            self._first_line_seen = True
+            self.events.append(("first_line", "".join(self._p_parts).strip()))
+        if self._open and depth == self._open[-1][0]:
+            self._open.pop()[1].done = True
+        if depth == self._ol_depth:
+            self._ol_depth = None
+            self._ol_done = True
+
+    def handle_data(self, data):
+        if self._span_depth is not None:
+            self._span_parts.append(data)
+        if self._p_depth is not None:
+            self._p_parts.append(data)
+        for _, definition in self._open:
+            definition.add(data)
+        self._flush_definitions()
+
+    def _flush_definitions(self):
+        # Definitions come out in document order, each as soon as its first line is complete
+        while self._pending and self._pending[0].done:
+            self.events.append(("definition", self._pending.pop(0).first_line()))
+
+    def finish(self):
+        """Close whatever the extract left open"""
+        self.close()
+        while self._stack:
+            depth = len(self._stack)
+            self._close(self._stack.pop(), depth)
+        self._flush_definitions()
+
+    @property
+    def finished(self):
+        return self._ol_done and not self._pending
+
+
+def iter_extract(extract: str) -> t.Iterator[t.Tuple[str, str]]:
+    """Yield ("title" | "first_line" | "definition", text) events while parsing an extract
+
+    Parsing stops as soon as the caller stops iterating, or after the first definition list.
+    """
+    parser = _ExtractParser()
+    for start in range(0, len(extract), CHUNK_SIZE):
+        parser.feed(extract[start:start + CHUNK_SIZE])
+        while parser.events:
+            yield parser.events.pop(0)
+        if parser.finished:
+            return
+    parser.finish()
+    while parser.events:
+        yield parser.events.pop(0)
+
+
+def build_word_data(extract: str, site_url: str, head_length: int, max_length: int,
+                    thread: bool = False) -> t.Dict[str, t.Any]:
+    """Build word_data from an extract, keeping only what fits in a post of max_length characters
+
+    With thread, the definitions that do not fit are kept in "more_lines" for replies.
+    """
+    return fit_word_data(iter_extract(extract), site_url, head_length, max_length, thread)
+
+
+def fit_word_data(events: t.Iterable[t.Tuple[str, str]], site_url: str, head_length: int,
+                  max_length: int, thread: bool = False) -> t.Dict[str, t.Any]:
+    """Build word_data from ("title" | "first_line" | "definition", text) events, whatever their source"""
+    sizeMessage = head_length
+    word_data = {"def_lines": []}
+    if thread:
+        word_data["more_lines"] = []
+    overflowed = False
+    def_num = 1
+
+    for kind, text in events:
+        if kind == "title":
+            word_data["word"] = text
+            word_data["url"] = f"{site_url}/wiki/{text.replace(' ', '_')}"
+            logger.info(" Title is : %s", text)
+        elif kind == "first_line":
+            word_data["first_line"] = text
+            logger.info(" First line is : %s", text)
+            sizeMessage += len(text)
+        elif kind == "definition":
+            def_line = f"{def_num} - {text}"
+            cur_length = len(def_line)
+            if overflowed:
+                word_data["more_lines"].append(def_line)
+                def_num += 1
+                continue
+            # Case when the definition is too long for bluesky
+            if sizeMessage + cur_length > max_length:
+                logger.info("Overflow detected at definition %s", def_num)
+                if not thread:
+                    buffer = max_length - sizeMessage - 7  # Maximal size for the def
+                    word_data["def_lines"].append(def_line[:buffer] + "[…]")
+                    break
+                # This definition and the next ones go to replies, unless none fits in the post at all
+                overflowed = True
+                if word_data["def_lines"]:
+                    word_data["more_lines"].append(def_line)
+                else:
+                    word_data["def_lines"].append(def_line[:max_length - sizeMessage - 7] + "[…]")
+                def_num += 1
+                continue
+            word_data["def_lines"].append(def_line)
+            sizeMessage += cur_length
+            def_num += 1
+
+    if "word" not in word_data or "first_line" not in word_data or not word_data["def_lines"]:
+        raise ValueError('Definition not found')
+
+    return word_data
+
+
+def reply_texts(lines: t.List[str], max_length: int) -> t.List[str]:
+    """Pack definition lines into as few replies of max_length characters as they fit in"""
+    texts, current = [], ""
+    for line in lines:
+        if len(line) + 1 > max_length:
+            # A single definition longer than a post is cut, as in the root post
+            line = line[:max_length - 4] + "[…]"
+        if current and len(current) + len(line) + 1 > max_length:
+            texts.append(current)
+            current = ""
+        current += f"{line}\n"
+    if current:
+        texts.append(current)
+    return texts
@@ -0,0 +1,73 @@
+import os
+import json
+import asyncio
+import logging
+import typing as t
+from datetime import date
+
+if t.TYPE_CHECKING:
+    from wiktionary_bluesky_bot import WiktionaryBlueskyBot
+
+logger = logging.getLogger(__name__)
+
+# JSON list of feeds; without one, the two feeds of the account set in the environment
+FEEDS_CONFIG = os.getenv("FEEDS_CONFIG")
+
+DEFAULT_FEEDS = [
+    {"name": "bot"},
+    {"name": "stranger", "template_family": "Entrée étrangère du jour", "posting": False},
+]
+
+# Settings of a feed; anything left out comes from the environment, like for a single bot
+_SETTINGS = {"name", "language", "site_url", "template_family", "message_head", "handle", "password_env", "posting",
+             "backend"}
+
+
+def load_feeds(path: t.Optional[str] = FEEDS_CONFIG) -> t.List[t.Dict[str, t.Any]]:
+    """Feed settings from a JSON file, the default feeds without one"""
+    if not path:
+        return [dict(feed) for feed in DEFAULT_FEEDS]
+    with open(path, encoding="utf-8") as f:
+        feeds = json.load(f)
+
+    names = set()
+    for feed in feeds:
+        unknown = set(feed) - _SETTINGS
+        if unknown:
+            raise ValueError(f"Unknown settings {sorted(unknown)} in feed {feed.get('name')!r}")
+        if not feed.get("name") or feed["name"] in names:
+            raise ValueError(f"Feeds need distinct names, got {feed.get('name')!r}")
+        names.add(feed["name"])
+    return feeds
+
+
+def build_bots(feeds: t.List[t.Dict[str, t.Any]], **shared) -> t.Dict[str, "WiktionaryBlueskyBot"]:
+    """One bot per feed, by name; shared holds the pools and caches they all use"""
+    from wiktionary_bluesky_bot import WiktionaryBlueskyBot
+
+    bots = {}
+    for feed in feeds:
+        settings = dict(feed)
+        # Passwords stay in the environment, the config only names the variable
+        password_env = settings.pop("password_env", None)
+        if password_env:
+            settings["password"] = os.getenv(password_env)
+        bots[feed["name"]] = WiktionaryBlueskyBot(**shared, **settings)
+    return bots
+
+
+async def run_feeds(bots: t.Dict[str, "WiktionaryBlueskyBot"], day: t.Optional[date] = None) -> t.Dict[str, bool]:
+    """Run every feed at once on the current event loop for a day (today by default), return whether each went through
+
+    The bots are expected to share one async HTTP client, so that the feeds share its
+    connections; a feed failing does not stop the others.
+    """
+    names = list(bots)
+    results = await asyncio.gather(*(bots[name].run_async(day) for name in names), return_exceptions=True)
+    outcome = {}
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            logger.error("Feed %s failed: %s", name, result)
+        outcome[name] = result is True
+    logger.info("Feeds done: %s", ", ".join(f"{name} {'ok' if ok else 'failed'}" for name, ok in outcome.items()))
+    return outcome
@@ -0,0 +1,143 @@
+import os
+import re
+import socket
+import logging
+import threading
+import typing as t
+
+import httpx
+
+from metrics import AsyncMeteredTransport, MeteredTransport
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = os.getenv(
+    "HTTP_USER_AGENT",
+    "wiktionary-bluesky-bot/1.0 (https://github.com/gouglov/wiktionary-bluesky-bot)"
+)
+
+# Link-card metadata lives in <head>; the body is never needed
+_HEAD_END = re.compile(rb"</head\s*>", re.IGNORECASE)
+MAX_HEAD_BYTES = int(os.getenv("HTTP_MAX_HEAD_BYTES", "262144"))
+
+_shared_client: t.Optional[httpx.Client] = None
+_shared_lock = threading.Lock()
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def build_limits() -> httpx.Limits:
+    """Connection pool limits, configurable from the environment"""
+    return httpx.Limits(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "10")),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "5")),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")),
+    )
+
+
+def build_timeout() -> httpx.Timeout:
+    """Timeouts so that no call can hang on a silent socket"""
+    return httpx.Timeout(
+        float(os.getenv("HTTP_TIMEOUT", "15")),
+        connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+        pool=float(os.getenv("HTTP_POOL_TIMEOUT", "5")),
+    )
+
+
+def build_http_client() -> httpx.Client:
+    """Build a keep-alive, HTTP/2-capable client"""
+    http2 = os.getenv("HTTP_HTTP2", "1") == "1" and _http2_available()
+    client = httpx.Client(
+        # Metered so that every stage reports the bytes it transferred
+        transport=MeteredTransport(httpx.HTTPTransport(http2=http2, limits=build_limits())),
+        timeout=build_timeout(),
+        headers={"User-Agent": USER_AGENT},
+        follow_redirects=True,
+    )
+    logger.info("HTTP client ready (http2=%s)", http2)
+    return client
+
+
+def build_async_http_client() -> httpx.AsyncClient:
+    """Async counterpart of build_http_client, bound to the loop that uses it"""
+    http2 = os.getenv("HTTP_HTTP2", "1") == "1" and _http2_available()
+    return httpx.AsyncClient(
+        transport=AsyncMeteredTransport(httpx.AsyncHTTPTransport(http2=http2, limits=build_limits())),
+        timeout=build_timeout(),
+        headers={"User-Agent": USER_AGENT},
+        follow_redirects=True,
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """Return the process-wide HTTP client, creating it on first use"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None or _shared_client.is_closed:
+            _shared_client = build_http_client()
+        return _shared_client
+
+
+def close_http_client():
+    """Close the process-wide HTTP client and its pooled connections"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is not None:
+            _shared_client.close()
+            _shared_client = None
+
+
+def resolve_hosts(urls: t.Iterable[str]):
+    """Resolve host names ahead of the requests, warming whatever DNS cache the system keeps"""
+    for url in urls:
+        parsed = httpx.URL(url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        try:
+            socket.getaddrinfo(parsed.host, port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            logger.error("Failed to resolve %s: %s", parsed.host, e)
+
+
+def _head_end(buffer: bytearray, chunk_length: int) -> int:
+    """Offset just past </head>, looking only at what the last chunk could have completed"""
+    match = _HEAD_END.search(buffer, max(0, len(buffer) - chunk_length - 8))
+    return match.end() if match else -1
+
+
+def fetch_html_head(http_client: httpx.Client, url: str, max_bytes: int = MAX_HEAD_BYTES) -> str:
+    """Read an HTML page only up to </head>, closing the stream there"""
+    with http_client.stream("GET", url) as response:
+        response.raise_for_status()
+        buffer = bytearray()
+        for chunk in response.iter_bytes():
+            buffer += chunk
+            end = _head_end(buffer, len(chunk))
+            if end != -1:
+                del buffer[end:]
+                break
+            if len(buffer) > max_bytes:
+                break
+        return buffer.decode(response.encoding or "utf-8", errors="replace")
+
+
+async def async_fetch_html_head(http_client: httpx.AsyncClient, url: str, max_bytes: int = MAX_HEAD_BYTES) -> str:
+    """Async counterpart of fetch_html_head"""
+    async with http_client.stream("GET", url) as response:
+        response.raise_for_status()
+        buffer = bytearray()
+        async for chunk in response.aiter_bytes():
+            buffer += chunk
+            end = _head_end(buffer, len(chunk))
+            if end != -1:
+                del buffer[end:]
+                break
+            if len(buffer) > max_bytes:
+                break
+        return buffer.decode(response.encoding or "utf-8", errors="replace")
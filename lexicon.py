@@ -0,0 +1,364 @@
+import os
+import re
+import bz2
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+import typing as t
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+LEXICON_PATH = os.getenv("LEXICON_PATH", os.path.join(DATA_DIR, "lexicon.sqlite"))
+
+# Series of day templates worth indexing, as used by both bots
+DAY_TEMPLATE_FAMILIES = ("Entrée du jour", "Entrée étrangère du jour")
+
+_HEADING = re.compile(r"^(=+)\s*(.*?)\s*\1\s*$")
+_LANGUAGE = re.compile(r"\{\{\s*langue\s*\|\s*([^|}\s]+)")
+_SECTION = re.compile(r"\{\{\s*S\s*\|\s*([^|}]+)")
+# Top-level definitions only: "#*" examples, "#:" notes and "##" sub-senses are not posted
+_DEFINITION = re.compile(r"^#(?![*:#])\s*(.*\S)")
+_NOINCLUDE = re.compile(r"<noinclude>.*?</noinclude>", re.DOTALL | re.IGNORECASE)
+_INCLUDEONLY = re.compile(r"</?(includeonly|onlyinclude)>", re.IGNORECASE)
+
+_GENDERS = {"m": "masculin", "f": "féminin", "mf": "masculin et féminin", "n": "neutre", "c": "commun"}
+_SECTION_ALIASES = {"adj": "adjectif", "adv": "adverbe", "nom-pr": "nom propre", "prép": "préposition",
+                    "interj": "interjection", "loc-phr": "locution-phrase", "pron": "pronom"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    title TEXT NOT NULL,
+    lang TEXT NOT NULL,
+    word TEXT NOT NULL,
+    first_line TEXT NOT NULL,
+    definitions TEXT NOT NULL,
+    PRIMARY KEY (title, lang)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+"""
+
+
+def _render_template(template, language: str) -> str:
+    """Text of the few templates that show up in a definition line"""
+    name = str(template.name).strip()
+    positional = [str(param.value).strip() for param in template.params if not param.showkey]
+    if name in _GENDERS:
+        return _GENDERS[name]
+    if name in ("term", "term_lien") and positional:
+        return f"({positional[0].capitalize()})"
+    if name == "lexique" and positional:
+        return "(" + ", ".join(value.capitalize() for value in positional[:-1] or positional) + ")"
+    if name in ("w", "lien", "l") and positional:
+        return positional[0]
+    if positional == [language] and re.fullmatch(r"[^\W\d_][\w -]*", name):
+        # Domain shortcuts such as {{ornithologie|fr}} render as "(Ornithologie)"
+        return f"({name.capitalize()})"
+    return ""
+
+
+def wikitext_to_text(wikitext: str, language: str = "fr") -> str:
+    """Plain text of a line of wikitext, as the rendered page would read"""
+    # Only parsing needs it; reading a built lexicon does not
+    import mwparserfromhell
+
+    code = mwparserfromhell.parse(wikitext)
+    for tag in code.filter_tags(recursive=False):
+        if str(tag.tag).lower() == "ref":
+            code.remove(tag)
+    for template in code.filter_templates(recursive=False):
+        code.replace(template, _render_template(template, language))
+    return " ".join(code.strip_code().split())
+
+
+def parse_article(title: str, wikitext: str, languages: t.Collection[str]) -> t.Dict[str, t.Dict[str, t.Any]]:
+    """First part-of-speech section of every wanted language of an article, keyed by language"""
+    entries = {}
+    language = pos = None
+    # None until the ligne de forme of the section is seen
+    genders: t.Optional[t.List[str]] = None
+    definitions: t.List[str] = []
+
+    def flush():
+        if language and pos and definitions and language not in entries:
+            nature = " ".join([pos] + (genders or []))
+            entries[language] = {"word": title, "first_line": f"{title} — {nature}", "definitions": list(definitions)}
+
+    for line in wikitext.splitlines():
+        heading = _HEADING.match(line)
+        if heading:
+            flush()
+            genders, definitions = None, []
+            level = len(heading.group(1))
+            if level == 2:
+                match = _LANGUAGE.search(heading.group(2))
+                language = match.group(1) if match and match.group(1) in languages else None
+                pos = None
+            elif level >= 3:
+                match = _SECTION.search(heading.group(2))
+                pos = _SECTION_ALIASES.get(match.group(1).strip(), match.group(1).strip()) if match else None
+            continue
+        if not language or not pos or language in entries:
+            continue
+        if line.startswith("'''") and not definitions:
+            # Ligne de forme, which carries the gender templates
+            genders = [_GENDERS[name] for name in re.findall(r"\{\{\s*(\w+)\s*\}\}", line) if name in _GENDERS]
+            continue
+        match = _DEFINITION.match(line)
+        if match and genders is not None:
+            text = wikitext_to_text(match.group(1), language)
+            if text:
+                definitions.append(text)
+    flush()
+    return entries
+
+
+def parse_day_template(wikitext: str, language: str = "fr") -> t.Optional[t.Dict[str, t.Any]]:
+    """Headword, first line and definitions of a day template, as its extract would show them"""
+    wikitext = _INCLUDEONLY.sub("", _NOINCLUDE.sub("", wikitext))
+    word = first_line = None
+    definitions: t.List[str] = []
+    for line in wikitext.splitlines():
+        if not line.strip() or _HEADING.match(line):
+            continue
+        match = _DEFINITION.match(line)
+        if match:
+            if first_line is not None:
+                text = wikitext_to_text(match.group(1), language)
+                if text:
+                    definitions.append(text)
+            continue
+        if line.startswith("#"):
+            # Examples and sub-senses of the current definition
+            continue
+        if line.startswith(("*", ":", "{|", "|", "!")):
+            if definitions:
+                # Past the first definition list
+                break
+            continue
+        if first_line is None:
+            text = wikitext_to_text(line, language)
+            if not text:
+                continue
+            first_line = text
+            import mwparserfromhell
+
+            code = mwparserfromhell.parse(line)
+            # The headword is the first bold text or link of the line
+            for node in code.filter_tags(recursive=True) + code.filter_wikilinks(recursive=True):
+                candidate = wikitext_to_text(str(node.contents if hasattr(node, "contents") else node.title))
+                if candidate:
+                    word = candidate
+                    break
+            word = word or text.split("—")[0].strip()
+        elif definitions:
+            break
+    if not (word and first_line and definitions):
+        return None
+    return {"word": word, "first_line": first_line, "definitions": definitions}
+
+
+class DumpReader:
+    """Streams the pages of a MediaWiki XML dump, .bz2 or plain, in constant memory"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dbname: t.Optional[str] = None
+
+    def __iter__(self) -> t.Iterator[t.Tuple[int, str, str, str]]:
+        """Yield (namespace, title, revision timestamp, wikitext) of every page that is not a redirect"""
+        opener = bz2.open if self.path.endswith(".bz2") else open
+        with opener(self.path, "rb") as f:
+            context = ET.iterparse(f, events=("start", "end"))
+            _, root = next(context)
+            ns = root.tag[:root.tag.index("}") + 1] if root.tag.startswith("{") else ""
+            for event, elem in context:
+                if event != "end":
+                    continue
+                if elem.tag == f"{ns}dbname":
+                    self.dbname = elem.text
+                elif elem.tag == f"{ns}page":
+                    if elem.find(f"{ns}redirect") is None:
+                        revision = elem.find(f"{ns}revision")
+                        yield (
+                            int(elem.findtext(f"{ns}ns", "0")),
+                            elem.findtext(f"{ns}title", ""),
+                            revision.findtext(f"{ns}timestamp", "") if revision is not None else "",
+                            revision.findtext(f"{ns}text", "") if revision is not None else "",
+                        )
+                    # Drop the pages already read, or the tree grows with the dump
+                    root.clear()
+
+
+def build_lexicon(dump_path: str, output: str = LEXICON_PATH, languages: t.Collection[str] = ("fr",),
+                  families: t.Collection[str] = DAY_TEMPLATE_FAMILIES, batch_size: int = 10000) -> t.Dict[str, t.Any]:
+    """Index the articles and day templates of a dump into a SQLite file, replaced atomically when done"""
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp_path = f"{output}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    # A crash only loses the .tmp file, durability is not needed while building
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.executescript(_SCHEMA)
+
+    prefixes = tuple(f"Modèle:{family}/" for family in families)
+    reader = DumpReader(dump_path)
+    stats = {"pages": 0, "entries": 0, "templates": 0}
+    newest = ""
+    rows = []
+    start = time.perf_counter()
+
+    def flush():
+        db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+        rows.clear()
+
+    for namespace, title, timestamp, text in reader:
+        stats["pages"] += 1
+        newest = max(newest, timestamp)
+        try:
+            if namespace == 0:
+                for language, entry in parse_article(title, text, languages).items():
+                    rows.append((title, language, entry["word"], entry["first_line"], "\n".join(entry["definitions"])))
+                    stats["entries"] += 1
+            elif namespace == 10 and title.startswith(prefixes):
+                entry = parse_day_template(text)
+                if entry:
+                    rows.append((title, "", entry["word"], entry["first_line"], "\n".join(entry["definitions"])))
+                    stats["templates"] += 1
+        except Exception as e:
+            logger.error("Skipping <%s>: %s", title, e)
+        if len(rows) >= batch_size:
+            flush()
+        if stats["pages"] % 100000 == 0:
+            logger.info("%d pages read, %d entries, %d templates", stats['pages'], stats['entries'], stats['templates'])
+    flush()
+
+    meta = {"dbname": reader.dbname or "", "newest_revision": newest, "dump": os.path.basename(dump_path),
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    db.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+    db.commit()
+    db.close()
+    os.replace(tmp_path, output)
+
+    stats.update(meta, seconds=round(time.perf_counter() - start, 1))
+    logger.info("Lexicon written to %s: %s", output, stats)
+    return stats
+
+
+def store_entries(rows: t.Iterable[t.Tuple[str, str, t.Dict[str, t.Any]]], dbname: str,
+                  path: str = LEXICON_PATH) -> int:
+    """Add or replace (title, language, entry) rows, creating the lexicon if there is none yet"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    db = sqlite3.connect(path)
+    try:
+        db.executescript(_SCHEMA)
+        row = db.execute("SELECT value FROM meta WHERE key = 'dbname'").fetchone()
+        if row is None:
+            db.execute("INSERT INTO meta VALUES ('dbname', ?)", (dbname,))
+        elif row[0] != dbname:
+            raise ValueError(f"{path} holds {row[0]} entries, not {dbname}")
+        with db:
+            count = db.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                ((title, lang, entry["word"], entry["first_line"], "\n".join(entry["definitions"]))
+                 for title, lang, entry in rows),
+            ).rowcount
+        return count
+    finally:
+        db.close()
+
+
+class Lexicon:
+    """Read-only lookups in a lexicon built by build_lexicon"""
+
+    def __init__(self, path: str = LEXICON_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.meta = dict(self._db.execute("SELECT key, value FROM meta"))
+
+    @property
+    def dbname(self) -> str:
+        return self.meta.get("dbname", "")
+
+    def get(self, title: str, language: t.Optional[str] = None) -> t.Optional[t.Dict[str, t.Any]]:
+        """Entry of a page, the given language first when the article has several"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT word, first_line, definitions FROM entries WHERE title = ? ORDER BY lang = ? DESC LIMIT 1",
+                (title, language or ""),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"word": row[0], "first_line": row[1], "definitions": row[2].split("\n")}
+
+    def close(self):
+        self._db.close()
+
+
+def lexicon_events(entry: t.Dict[str, t.Any]) -> t.Iterator[t.Tuple[str, str]]:
+    """The events iter_extract would produce for the same entry"""
+    yield "title", entry["word"]
+    yield "first_line", entry["first_line"]
+    for definition in entry["definitions"]:
+        yield "definition", definition
+
+
+_default_lexicon: t.Optional[Lexicon] = None
+_default_lock = threading.Lock()
+
+
+def get_lexicon(language: t.Optional[str]) -> t.Optional[Lexicon]:
+    """The process-wide lexicon for a Wiktionary edition, None when no matching one was built"""
+    global _default_lexicon
+    with _default_lock:
+        if _default_lexicon is None:
+            if not os.path.exists(LEXICON_PATH):
+                return None
+            try:
+                _default_lexicon = Lexicon(LEXICON_PATH)
+            except sqlite3.Error as e:
+                logger.error("Ignoring unreadable lexicon %s: %s", LEXICON_PATH, e)
+                return None
+    if _default_lexicon.dbname != f"{language}wiktionary":
+        return None
+    return _default_lexicon
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local lexicon built from a Wiktionary pages-articles dump")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index a pages-articles .xml.bz2 dump")
+    build.add_argument("dump")
+    build.add_argument("--output", default=LEXICON_PATH)
+    build.add_argument("--languages", default="fr", help="comma-separated language codes of the articles to keep")
+    lookup = commands.add_parser("lookup", help="print the entry of a page")
+    lookup.add_argument("title")
+    lookup.add_argument("--language", default="fr")
+    lookup.add_argument("--path", default=LEXICON_PATH)
+    args = parser.parse_args(argv)
+
+    from oneshot import configure
+
+    configure()
+    if args.command == "build":
+        build_lexicon(args.dump, args.output, languages=args.languages.split(","))
+        return 0
+    entry = Lexicon(args.path).get(args.title, args.language)
+    if entry is None:
+        print(f"<{args.title}> is not in the lexicon")
+        return 1
+    print(entry["first_line"])
+    for number, definition in enumerate(entry["definitions"], 1):
+        print(f"{number} - {definition}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
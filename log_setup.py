@@ -0,0 +1,81 @@
+import os
+import queue
+import atexit
+import logging
+import logging.handlers
+import typing as t
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Log files rotate past this size, keeping this many old files
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "3"))
+# Longest message written, tracebacks aside
+LOG_MAX_MESSAGE = int(os.getenv("LOG_MAX_MESSAGE", "2000"))
+# Longest rendering of a payload (word data, extracts, API responses) inside a message
+LOG_MAX_PAYLOAD = int(os.getenv("LOG_MAX_PAYLOAD", "300"))
+
+_listener: t.Optional[logging.handlers.QueueListener] = None
+_queue_handler: t.Optional[logging.handlers.QueueHandler] = None
+
+
+def truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}… [{len(text) - limit} more chars]"
+
+
+class Clipped:
+    """A log argument rendered, and cut to a length, only if its record is actually emitted"""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: t.Any, limit: int = LOG_MAX_PAYLOAD):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        return truncate(str(self.value), self.limit)
+
+
+class _TruncatingFormatter(logging.Formatter):
+    """Renders the message in the calling thread, capped; the listener's handlers add the rest"""
+
+    def formatMessage(self, record):
+        return truncate(record.message, LOG_MAX_MESSAGE)
+
+
+def setup_logging(log_file: t.Optional[str] = None, level: str = LOG_LEVEL):
+    """Log to stderr and optionally to a size-rotated file, the writes done by a listener thread"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers: t.List[logging.Handler] = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # Callers only format and enqueue; stream and disk writes happen on the listener's thread
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    _queue_handler.setFormatter(_TruncatingFormatter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out what is still queued; called at exit"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        _listener, _queue_handler = None, None
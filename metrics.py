@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+import typing as t
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the stage duration histogram, in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Span of the stage currently running in this thread / task, bytes and retries are charged to it
+_current_span: contextvars.ContextVar[t.Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed stage of a run"""
+
+    def __init__(self, registry: "Metrics", bot: str, stage: str):
+        self.registry = registry
+        self.bot = bot
+        self.stage = stage
+        self.outcome = "ok"
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+        self.duration = 0.0
+        self._start = 0.0
+        self._token = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        if self.stage == "run":
+            self.registry._start_run(self.bot)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.outcome = "error"
+        self.registry._record(self)
+        return False
+
+    def as_dict(self):
+        return {
+            "stage": self.stage,
+            "outcome": self.outcome,
+            "duration_s": round(self.duration, 6),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "retries": self.retries,
+        }
+
+
+class Metrics:
+    """Per-stage durations, bytes, retries and outcomes, plus a summary of each bot's last run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = defaultdict(lambda: [0] * len(BUCKETS))
+        self._duration_sum = defaultdict(float)
+        self._duration_count = defaultdict(int)
+        self._outcomes = defaultdict(int)
+        self._bytes = defaultdict(int)
+        self._retries = defaultdict(int)
+        self._current_runs: t.Dict[str, t.List[t.Dict[str, t.Any]]] = {}
+        self.last_runs: t.Dict[str, t.Dict[str, t.Any]] = {}
+        self.last_success: t.Dict[str, float] = {}
+
+    def span(self, bot: str, stage: str) -> Span:
+        return Span(self, bot, stage)
+
+    def _start_run(self, bot):
+        with self._lock:
+            self._current_runs[bot] = []
+
+    def _record(self, span: Span):
+        with self._lock:
+            key = (span.bot, span.stage)
+            for i, bound in enumerate(BUCKETS):
+                if span.duration <= bound:
+                    self._buckets[key][i] += 1
+            self._duration_sum[key] += span.duration
+            self._duration_count[key] += 1
+            self._outcomes[key + (span.outcome,)] += 1
+            self._bytes[key + ("in",)] += span.bytes_in
+            self._bytes[key + ("out",)] += span.bytes_out
+            self._retries[key] += span.retries
+
+            if span.stage != "run":
+                if span.bot in self._current_runs:
+                    self._current_runs[span.bot].append(span.as_dict())
+                return
+            now = time.time()
+            if span.outcome == "ok":
+                self.last_success[span.bot] = now
+            self.last_runs[span.bot] = {
+                "timestamp": now,
+                "success": span.outcome == "ok",
+                "duration_s": round(span.duration, 6),
+                "stages": self._current_runs.pop(span.bot, []),
+            }
+
+    def add_retry(self):
+        """Count a retried call against the running stage"""
+        span = _current_span.get()
+        if span is not None:
+            span.retries += 1
+
+    def summary(self) -> t.Dict[str, t.Any]:
+        """JSON run summary, one entry per bot"""
+        with self._lock:
+            return {
+                "generated_at": time.time(),
+                "bots": {
+                    bot: dict(run, last_success=self.last_success.get(bot))
+                    for bot, run in self.last_runs.items()
+                },
+            }
+
+    def render_prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def labels(**values):
+            return "{" + ",".join(f'{key}="{value}"' for key, value in values.items()) + "}"
+
+        with self._lock:
+            lines.append("# HELP wiktionary_bot_stage_duration_seconds Duration of each bot stage")
+            lines.append("# TYPE wiktionary_bot_stage_duration_seconds histogram")
+            for (bot, stage), counts in sorted(self._buckets.items()):
+                for bound, count in zip(BUCKETS, counts):
+                    lines.append(f"wiktionary_bot_stage_duration_seconds_bucket{labels(bot=bot, stage=stage, le=bound)} {count}")
+                total = self._duration_count[(bot, stage)]
+                lines.append(f"wiktionary_bot_stage_duration_seconds_bucket{labels(bot=bot, stage=stage, le='+Inf')} {total}")
+                lines.append(f"wiktionary_bot_stage_duration_seconds_sum{labels(bot=bot, stage=stage)} {self._duration_sum[(bot, stage)]}")
+                lines.append(f"wiktionary_bot_stage_duration_seconds_count{labels(bot=bot, stage=stage)} {total}")
+
+            lines.append("# HELP wiktionary_bot_stage_total Stages run, by outcome")
+            lines.append("# TYPE wiktionary_bot_stage_total counter")
+            for (bot, stage, outcome), count in sorted(self._outcomes.items()):
+                lines.append(f"wiktionary_bot_stage_total{labels(bot=bot, stage=stage, outcome=outcome)} {count}")
+
+            lines.append("# HELP wiktionary_bot_bytes_total HTTP bytes transferred by each stage")
+            lines.append("# TYPE wiktionary_bot_bytes_total counter")
+            for (bot, stage, direction), count in sorted(self._bytes.items()):
+                lines.append(f"wiktionary_bot_bytes_total{labels(bot=bot, stage=stage, direction=direction)} {count}")
+
+            lines.append("# HELP wiktionary_bot_retries_total Retried remote calls of each stage")
+            lines.append("# TYPE wiktionary_bot_retries_total counter")
+            for (bot, stage), count in sorted(self._retries.items()):
+                lines.append(f"wiktionary_bot_retries_total{labels(bot=bot, stage=stage)} {count}")
+
+            lines.append("# HELP wiktionary_bot_last_run_timestamp_seconds End of the last run")
+            lines.append("# TYPE wiktionary_bot_last_run_timestamp_seconds gauge")
+            for bot, run in sorted(self.last_runs.items()):
+                lines.append(f"wiktionary_bot_last_run_timestamp_seconds{labels(bot=bot)} {run['timestamp']}")
+            lines.append("# HELP wiktionary_bot_last_run_success Whether the last run posted")
+            lines.append("# TYPE wiktionary_bot_last_run_success gauge")
+            for bot, run in sorted(self.last_runs.items()):
+                lines.append(f"wiktionary_bot_last_run_success{labels(bot=bot)} {int(run['success'])}")
+            lines.append("# HELP wiktionary_bot_last_success_timestamp_seconds End of the last successful run")
+            lines.append("# TYPE wiktionary_bot_last_success_timestamp_seconds gauge")
+            for bot, timestamp in sorted(self.last_success.items()):
+                lines.append(f"wiktionary_bot_last_success_timestamp_seconds{labels(bot=bot)} {timestamp}")
+
+        return "\n".join(lines) + "\n"
+
+
+_default_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _default_metrics
+
+
+def timed_stage(stage: str):
+    """Run a bot method inside a span; a None or False result counts as a failed stage"""
+
+    def decorator(method):
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                with get_metrics().span(getattr(self, "name", type(self).__name__), stage) as span:
+                    result = await method(self, *args, **kwargs)
+                    if result is None or result is False:
+                        span.outcome = "error"
+                    return result
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with get_metrics().span(getattr(self, "name", type(self).__name__), stage) as span:
+                result = method(self, *args, **kwargs)
+                if result is None or result is False:
+                    span.outcome = "error"
+                return result
+        return wrapper
+
+    return decorator
+
+
+class _CountingStream(httpx.SyncByteStream):
+    def __init__(self, stream, span: t.Optional[Span]):
+        self._stream = stream
+        self._span = span
+
+    def __iter__(self):
+        for chunk in self._stream:
+            if self._span is not None:
+                self._span.bytes_in += len(chunk)
+            yield chunk
+
+    def close(self):
+        self._stream.close()
+
+
+class _AsyncCountingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, span: t.Optional[Span]):
+        self._stream = stream
+        self._span = span
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            if self._span is not None:
+                self._span.bytes_in += len(chunk)
+            yield chunk
+
+    async def aclose(self):
+        await self._stream.aclose()
+
+
+def _request_size(request: httpx.Request) -> int:
+    return int(request.headers.get("content-length") or 0)
+
+
+class MeteredTransport(httpx.BaseTransport):
+    """Charges the bytes on the wire (compressed) to the stage that made the request"""
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request):
+        span = _current_span.get()
+        if span is not None:
+            span.bytes_out += _request_size(request)
+        response = self._transport.handle_request(request)
+        response.stream = _CountingStream(response.stream, span)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncMeteredTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of MeteredTransport"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        span = _current_span.get()
+        if span is not None:
+            span.bytes_out += _request_size(request)
+        response = await self._transport.handle_async_request(request)
+        response.stream = _AsyncCountingStream(response.stream, span)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def write_summary(path: str, registry: t.Optional[Metrics] = None):
+    """Write the JSON run summary next to the other persisted data"""
+    registry = registry or get_metrics()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(registry.summary(), f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error("Failed to write the run summary: %s", e)
+
+
+def serve_metrics(host: str, port: int, registry: t.Optional[Metrics] = None) -> ThreadingHTTPServer:
+    """Serve /metrics (Prometheus) and /summary (JSON) from a background thread"""
+    registry = registry or get_metrics()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = registry.render_prometheus().encode()
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/summary":
+                body = json.dumps(registry.summary()).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Metrics served on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import importlib
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+# Seconds spent importing each module, in import order
+_import_times: t.Dict[str, float] = {}
+
+
+def configure(log_file: t.Optional[str] = None):
+    """Process setup of an entry point: .env settings, then logging to stderr and optionally a file"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    # Imported after .env, which may set the log settings
+    from log_setup import setup_logging
+
+    setup_logging(log_file)
+
+
+def timed_import(name: str):
+    """Import a module, recording how long it took when this is its first import"""
+    if name in sys.modules:
+        return sys.modules[name]
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    _import_times[name] = time.perf_counter() - started
+    return module
+
+
+def import_report() -> str:
+    total = sum(_import_times.values())
+    lines = [f"{name:<28} {seconds * 1000:8.1f} ms" for name, seconds in _import_times.items()]
+    lines.append(f"{'total':<28} {total * 1000:8.1f} ms")
+    # The point of dry-run and prefetch is to never pay for it
+    lines.append(f"atproto loaded: {'yes' if 'atproto' in sys.modules else 'no'}")
+    return "\n".join(lines)
+
+
+def _dry_run(bot) -> bool:
+    """Resolve and render today's post without touching Bluesky"""
+    word_data = bot.get_word_data(bot.get_today_word())
+    if not word_data:
+        return False
+    if bot.posted_words.seen(bot.bluesky_handle, word_data['word']):
+        logger.warning("<%s> was already posted by %s", word_data['word'], bot.bluesky_handle)
+    text, _ = bot._build_post_text(word_data)
+    title, img_data = bot.get_link_card(word_data['url'])
+    print(text)
+    for reply in bot._build_replies(word_data):
+        print(f"↳ {reply}")
+    print(f"Link card: {title} ({len(img_data) if img_data else 0} bytes of thumbnail)")
+    return True
+
+
+def _run_feeds() -> bool:
+    """Run every configured feed at once, on one async pool"""
+    import asyncio
+    feeds = timed_import("feeds")
+    from http_client import build_async_http_client
+
+    async def run():
+        async with build_async_http_client() as async_http:
+            return await feeds.run_feeds(feeds.build_bots(feeds.load_feeds(), async_http_client=async_http))
+
+    return all(asyncio.run(run()).values())
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run one job and exit, importing only what that job needs")
+    parser.add_argument("job", nargs="?", default="bot", choices=("bot", "stranger", "feeds", "prefetch", "dry-run"))
+    parser.add_argument("--days", type=int, default=int(os.getenv("PREFETCH_DAYS", "7")),
+                        help="days to prefetch")
+    parser.add_argument("--log-file", help="also log to this file")
+    parser.add_argument("--import-times", action="store_true", help="print the import-time breakdown")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    timed_import("dotenv")
+    # Settings are read by the modules below as they are imported
+    configure(args.log_file)
+
+    # Heaviest first, so that each line only counts the module itself
+    timed_import("httpx")
+    if args.job in ("bot", "stranger", "feeds"):
+        timed_import("atproto")
+
+    if args.job == "stranger":
+        bot = timed_import("wiktionary_stranger").WiktionayStranger()
+    elif args.job == "feeds":
+        timed_import("wiktionary_bluesky_bot")
+    else:
+        bot = timed_import("wiktionary_bluesky_bot").WiktionaryBlueskyBot()
+    ready = time.perf_counter()
+
+    if args.job == "feeds":
+        success = _run_feeds()
+    elif args.job == "prefetch":
+        prefetch_cache = timed_import("prefetch_cache")
+        success = prefetch_cache.prefetch_upcoming(bot, prefetch_cache.PrefetchCache(), args.days) > 0
+    elif args.job == "dry-run":
+        success = _dry_run(bot)
+    elif args.job == "bot" and os.getenv("BOT_ASYNC") == "1":
+        import asyncio
+        success = asyncio.run(bot.run_async())
+    else:
+        success = bot.run()
+
+    finished = time.perf_counter()
+    logger.info("Started in %.3f s, ran in %.3f s", ready - started, finished - ready)
+    report = import_report()
+    if args.import_times:
+        print(report)
+    else:
+        logger.info("Import times:\n%s", report)
+
+    from http_client import close_http_client
+    close_http_client()
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
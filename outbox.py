@@ -0,0 +1,398 @@
+import os
+import json
+import asyncio
+import zlib
+import sqlite3
+import logging
+import threading
+import typing as t
+from datetime import date, datetime, timedelta, timezone
+
+if t.TYPE_CHECKING:
+    from atproto_client.models.blob_ref import BlobRef
+
+import clock
+from blob_cache import async_upload_thumb, get_blob_cache, upload_thumb
+from bluesky_session import PDS_HOST
+from dag_cbor import record_cid
+from retry import (BREAKER_COOLDOWN, RETRY_MAX_DELAY, CircuitOpenError, async_call_with_retry, call_with_retry,
+                   classify, describe_error, rate_limit_delay)
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", os.path.join(DATA_DIR, "outbox.sqlite"))
+# A post still unsent after this many attempts, or this long after it was queued, is given up
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_MAX_AGE = float(os.getenv("OUTBOX_MAX_AGE_HOURS", "12")) * 3600
+# Delay before the second attempt, doubled at each further one
+OUTBOX_RETRY_DELAY = float(os.getenv("OUTBOX_RETRY_DELAY", "60"))
+OUTBOX_MAX_RETRY_DELAY = float(os.getenv("OUTBOX_MAX_RETRY_DELAY", "3600"))
+# The PDS garbage-collects blobs no record references: a thumbnail uploaded this long before the post is sent,
+# or before a failed attempt, is uploaded again
+OUTBOX_BLOB_MAX_AGE = float(os.getenv("OUTBOX_BLOB_MAX_AGE", "1800"))
+
+POST_COLLECTION = "app.bsky.feed.post"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    handle TEXT NOT NULL,
+    rkey TEXT NOT NULL,
+    word TEXT NOT NULL,
+    text TEXT NOT NULL,
+    embed TEXT,
+    image BLOB,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    queued_at REAL NOT NULL,
+    uri TEXT,
+    last_error TEXT,
+    replies TEXT,
+    PRIMARY KEY (handle, rkey)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS posts_due ON posts (status, next_attempt_at);
+"""
+
+_COLUMNS = ("handle", "rkey", "word", "text", "embed", "image", "status", "attempts", "next_attempt_at", "queued_at",
+            "uri", "last_error", "replies")
+
+_TID_ALPHABET = "234567abcdefghijklmnopqrstuvwxyz"
+
+
+class PostNotSent(Exception):
+    """The post is queued but could not be sent yet, or was given up"""
+
+
+def tid(microseconds: int, clock_id: int) -> str:
+    """Record key in the TID format: 53 bits of microseconds then a 10-bit clock id, base32-sortable"""
+    value = (microseconds << 10) | (clock_id & 0x3FF)
+    chars = []
+    for _ in range(13):
+        chars.append(_TID_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def tid_offset(rkey: str, offset: int) -> str:
+    """The TID offset microseconds after another one, with the same clock id"""
+    value = 0
+    for char in rkey:
+        value = value << 5 | _TID_ALPHABET.index(char)
+    return tid((value >> 10) + offset, value & 0x3FF)
+
+
+def post_rkey(day: date, *scope: str) -> str:
+    """The same record key for the same day and scope (account, template family), in every process"""
+    midnight = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    return tid(int(midnight.timestamp()) * 1_000_000, zlib.crc32("|".join(scope).encode("utf-8")))
+
+
+class Outbox:
+    """Rendered posts waiting to be sent, in SQLite so that they survive failures and restarts
+
+    Each post has a deterministic record key: a retry can never create a second post,
+    and before retrying an attempt whose outcome is unknown the record is looked up.
+    A post with replies is written with them in one applyWrites commit, all or nothing,
+    so looking the post up tells about the whole thread.
+    """
+
+    def __init__(self, path: str = OUTBOX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # One drain per account at a time: feeds sharing an account would otherwise send each other's posts twice
+        self._draining: t.Dict[str, threading.Lock] = {}
+        self._async_draining: t.Dict[str, asyncio.Lock] = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        if "replies" not in {row[1] for row in self._db.execute("PRAGMA table_info(posts)")}:
+            # Outboxes created before threads
+            self._db.execute("ALTER TABLE posts ADD COLUMN replies TEXT")
+
+    def enqueue(self, handle: str, rkey: str, word: str, text: str, embed: t.Optional[t.Dict[str, t.Any]],
+                image: t.Optional[bytes], replies: t.Optional[t.List[str]] = None) -> str:
+        """Queue a post, with the texts of its replies if any, unless this record key already is; return its status
+
+        A post given up on is queued again from scratch, with the new rendering and thumbnail: its record key is
+        the day's, so there is no other way to send it. Should an earlier attempt have written it after all,
+        the failed create is followed by a lookup, as after any failure.
+        """
+        now = clock.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO posts (handle, rkey, word, text, embed, image, replies, next_attempt_at, queued_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (handle, rkey) DO UPDATE SET word = excluded.word, text = excluded.text, "
+                "embed = excluded.embed, image = excluded.image, replies = excluded.replies, status = 'pending', "
+                "attempts = 0, next_attempt_at = excluded.next_attempt_at, queued_at = excluded.queued_at, "
+                "last_error = NULL WHERE posts.status = 'failed'",
+                (handle, rkey, word, text, json.dumps(embed) if embed else None, image,
+                 json.dumps(replies, ensure_ascii=False) if replies else None, now, now),
+            )
+        return self.status(handle, rkey)
+
+    def status(self, handle: str, rkey: str) -> t.Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT status FROM posts WHERE handle = ? AND rkey = ?", (handle, rkey)).fetchone()
+        return row[0] if row else None
+
+    def next_due(self, handle: t.Optional[str] = None) -> t.Optional[float]:
+        """Epoch of the next pending attempt (of one account if given), None when nothing is pending"""
+        query, args = "SELECT MIN(next_attempt_at) FROM posts WHERE status = 'pending'", ()
+        if handle is not None:
+            query, args = query + " AND handle = ?", (handle,)
+        with self._lock:
+            return self._db.execute(query, args).fetchone()[0]
+
+    def due(self, handle: str) -> bool:
+        next_due = self.next_due(handle)
+        return next_due is not None and next_due <= clock.time()
+
+    def _due_posts(self, handle: str) -> t.List[t.Dict[str, t.Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM posts WHERE status = 'pending' AND handle = ? "
+                "AND next_attempt_at <= ? ORDER BY queued_at",
+                (handle, clock.time()),
+            ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def _update(self, post: t.Dict[str, t.Any], **values):
+        post.update(values)
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with self._lock, self._db:
+            self._db.execute(f"UPDATE posts SET {assignments} WHERE handle = ? AND rkey = ?",
+                             (*values.values(), post["handle"], post["rkey"]))
+
+    def _begin(self, post):
+        # Written before the call: after a crash the next attempt knows to look the record up first
+        self._update(post, attempts=post["attempts"] + 1)
+
+    def _sent(self, post, uri: str):
+        logger.info("Posted <%s> as %s", post['word'], uri)
+        # The image was only kept for the blob cache of the sender
+        image = post["image"]
+        self._update(post, status="sent", uri=uri, image=None, last_error=None)
+        post["image"] = image
+
+    def _defer_all(self, handle: str, delay: float):
+        with self._lock, self._db:
+            self._db.execute("UPDATE posts SET next_attempt_at = MAX(next_attempt_at, ?) "
+                             "WHERE status = 'pending' AND handle = ?", (clock.time() + delay, handle))
+
+    def _retry_later(self, post, error: Exception):
+        transient, requested = classify(error, idempotent=True)
+        if isinstance(error, CircuitOpenError):
+            transient, requested = True, BREAKER_COOLDOWN
+        backoff = min(OUTBOX_MAX_RETRY_DELAY, OUTBOX_RETRY_DELAY * 2 ** max(0, post["attempts"] - 1))
+        delay = max(requested if requested is not None else backoff, rate_limit_delay(PDS_HOST))
+        expired = clock.time() + delay - post["queued_at"] > OUTBOX_MAX_AGE
+        reason = describe_error(error)
+        if not transient or post["attempts"] >= OUTBOX_MAX_ATTEMPTS or expired:
+            logger.error("Giving up on the post of <%s> after %d attempts: %s", post['word'], post['attempts'], reason)
+            self._update(post, status="failed", last_error=reason, image=None)
+        else:
+            logger.warning("Post of <%s> failed, next attempt in %.0f s: %s", post['word'], delay, reason)
+            self._update(post, next_attempt_at=clock.time() + delay, last_error=reason)
+
+    def _held(self, handle: str) -> bool:
+        delay = rate_limit_delay(PDS_HOST)
+        if delay > 0:
+            logger.warning("PDS rate limit nearly used up, holding the posts of %s for %.0f s", handle, delay)
+            self._defer_all(handle, delay)
+        return delay > 0
+
+    def _stale_thumb(self, post) -> bool:
+        """True when the thumbnail's blob may no longer be on the PDS"""
+        if not post["image"] or post_thumb(post) is None:
+            return False
+        return bool(post["attempts"]) or clock.time() - post["queued_at"] > OUTBOX_BLOB_MAX_AGE
+
+    def _set_thumb(self, post, blob: t.Optional["BlobRef"]):
+        embed = json.loads(post["embed"])
+        if blob is None:
+            embed["external"].pop("thumb", None)
+        else:
+            embed["external"]["thumb"] = blob.model_dump(mode="json", by_alias=True, exclude_none=True)
+        self._update(post, embed=json.dumps(embed))
+
+    def drain(self, handle: str, client, blob_cache=None) -> t.List[t.Dict[str, t.Any]]:
+        """Send the due posts of an account with its logged-in client, return those sent
+
+        blob_cache tells which thumbnails are already referenced, and safe to reuse, when one is uploaded again.
+        """
+        with self._lock:
+            draining = self._draining.setdefault(handle, threading.Lock())
+        with draining:
+            return self._drain(handle, client, blob_cache or get_blob_cache())
+
+    def _drain(self, handle: str, client, blob_cache) -> t.List[t.Dict[str, t.Any]]:
+        sent = []
+        for post in self._due_posts(handle):
+            if self._held(handle):
+                break
+            did = client.me.did
+            try:
+                uri = _existing_uri(client, did, post) if post["attempts"] else None
+                if uri is None:
+                    if self._stale_thumb(post):
+                        self._set_thumb(post, upload_thumb(client, post["image"], blob_cache))
+                    self._begin(post)
+                    uri = _create(client, did, post)
+            except Exception as e:
+                # The record may have been written even though the response was lost
+                uri = _existing_uri(client, did, post, quiet=True)
+                if uri is None:
+                    self._retry_later(post, e)
+                    continue
+            self._sent(post, uri)
+            sent.append(post)
+        return sent
+
+    async def async_drain(self, handle: str, client, blob_cache=None) -> t.List[t.Dict[str, t.Any]]:
+        """Async counterpart of drain"""
+        async with self._async_draining.setdefault(handle, asyncio.Lock()):
+            return await self._async_drain(handle, client, blob_cache or get_blob_cache())
+
+    async def _async_drain(self, handle: str, client, blob_cache) -> t.List[t.Dict[str, t.Any]]:
+        sent = []
+        for post in self._due_posts(handle):
+            if self._held(handle):
+                break
+            did = client.me.did
+            try:
+                uri = await _async_existing_uri(client, did, post) if post["attempts"] else None
+                if uri is None:
+                    if self._stale_thumb(post):
+                        self._set_thumb(post, await async_upload_thumb(client, post["image"], blob_cache))
+                    self._begin(post)
+                    uri = await _async_create(client, did, post)
+            except Exception as e:
+                uri = await _async_existing_uri(client, did, post, quiet=True)
+                if uri is None:
+                    self._retry_later(post, e)
+                    continue
+            self._sent(post, uri)
+            sent.append(post)
+        return sent
+
+    def close(self):
+        self._db.close()
+
+
+def _record(client, post):
+    from atproto import models
+    from atproto_client.models.languages import DEFAULT_LANGUAGE_CODE1
+
+    embed = models.AppBskyEmbedExternal.Main.model_validate(json.loads(post["embed"])) if post["embed"] else None
+    # Same record as client.send_post, dated when it is actually sent
+    return models.AppBskyFeedPost.Record(created_at=client.get_current_time_iso(), text=post["text"], embed=embed,
+                                         langs=[DEFAULT_LANGUAGE_CODE1])
+
+
+def _wire_record(record: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    """A post record exactly as the client sends it
+
+    Validating and dumping it adds the $type of every nested object (embed, strong refs, reply ref),
+    which its CID has to cover; dumping it again gives the same record.
+    """
+    from atproto import models
+    from atproto_client.models.utils import get_model_as_json, get_or_create
+
+    return json.loads(get_model_as_json(get_or_create(record, models.AppBskyFeedPost.Record)))
+
+
+def _thread_writes(did, post) -> t.List[t.Dict[str, t.Any]]:
+    """applyWrites creates of a post and its replies, each reply pointing at the CIDs computed for the previous ones"""
+    from atproto_client.models.languages import DEFAULT_LANGUAGE_CODE1
+
+    sent_at = clock.now(timezone.utc)
+    writes, root, parent = [], None, None
+    for index, text in enumerate([post["text"], *json.loads(post["replies"])]):
+        # A millisecond apart, so that the thread reads in order
+        created_at = (sent_at + timedelta(milliseconds=index)).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        record = {"$type": POST_COLLECTION, "text": text, "createdAt": created_at, "langs": [DEFAULT_LANGUAGE_CODE1]}
+        if root is None and post["embed"]:
+            record["embed"] = json.loads(post["embed"])
+        if root is not None:
+            record["reply"] = {"root": root, "parent": parent}
+        record = _wire_record(record)
+        rkey = tid_offset(post["rkey"], index)
+        parent = {"uri": f"at://{did}/{POST_COLLECTION}/{rkey}", "cid": record_cid(record)}
+        root = root or parent
+        writes.append({"$type": "com.atproto.repo.applyWrites#create", "collection": POST_COLLECTION, "rkey": rkey,
+                       "value": record})
+    return writes
+
+
+def _create(client, did, post) -> str:
+    """Write the post, and its replies in the same commit, return the URI of the post"""
+    # Only retried in place when surely not sent; anything else is looked up, then rescheduled
+    if not post["replies"]:
+        return call_with_retry(client.app.bsky.feed.post.create, did, _record(client, post), rkey=post["rkey"],
+                               host=PDS_HOST, idempotent=False, max_delay=RETRY_MAX_DELAY).uri
+    call_with_retry(client.com.atproto.repo.apply_writes, {"repo": did, "writes": _thread_writes(did, post)},
+                    host=PDS_HOST, idempotent=False, max_delay=RETRY_MAX_DELAY)
+    return f"at://{did}/{POST_COLLECTION}/{post['rkey']}"
+
+
+async def _async_create(client, did, post) -> str:
+    if not post["replies"]:
+        return (await async_call_with_retry(client.app.bsky.feed.post.create, did, _record(client, post),
+                                            rkey=post["rkey"], host=PDS_HOST, idempotent=False,
+                                            max_delay=RETRY_MAX_DELAY)).uri
+    writes = _thread_writes(did, post)
+    await async_call_with_retry(client.com.atproto.repo.apply_writes, {"repo": did, "writes": writes},
+                                host=PDS_HOST, idempotent=False, max_delay=RETRY_MAX_DELAY)
+    return f"at://{did}/{POST_COLLECTION}/{post['rkey']}"
+
+
+def _not_found(error: Exception) -> bool:
+    from atproto_client.exceptions import BadRequestError
+
+    return isinstance(error, BadRequestError)
+
+
+def _existing_uri(client, did, post, quiet=False) -> t.Optional[str]:
+    """URI of the post's record if the PDS has it, None if not (or, when quiet, if that cannot be told)"""
+    try:
+        return call_with_retry(client.app.bsky.feed.post.get, did, post["rkey"], host=PDS_HOST).uri
+    except Exception as e:
+        if quiet or _not_found(e):
+            return None
+        raise
+
+
+async def _async_existing_uri(client, did, post, quiet=False) -> t.Optional[str]:
+    try:
+        return (await async_call_with_retry(client.app.bsky.feed.post.get, did, post["rkey"], host=PDS_HOST)).uri
+    except Exception as e:
+        if quiet or _not_found(e):
+            return None
+        raise
+
+
+def post_thumb(post) -> t.Optional["BlobRef"]:
+    """Blob of the link card thumbnail of a queued post"""
+    from atproto_client.models.blob_ref import BlobRef
+
+    thumb = json.loads(post["embed"]).get("external", {}).get("thumb") if post["embed"] else None
+    return BlobRef.model_validate(thumb) if thumb else None
+
+
+def embed_dict(embed) -> t.Optional[t.Dict[str, t.Any]]:
+    """JSON form of an embed model, as stored in the outbox"""
+    return embed.model_dump(mode="json", by_alias=True, exclude_none=True) if embed is not None else None
+
+
+_default_outbox: t.Optional[Outbox] = None
+_default_lock = threading.Lock()
+
+
+def get_outbox() -> Outbox:
+    global _default_outbox
+    with _default_lock:
+        if _default_outbox is None:
+            _default_outbox = Outbox()
+        return _default_outbox
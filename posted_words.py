@@ -0,0 +1,106 @@
+import os
+import json
+import logging
+import threading
+import unicodedata
+import typing as t
+
+import clock
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+# Words posted before the log existed, shared by every account
+SEED_PATH = os.getenv("POSTED_WORDS_SEED",
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), "posted_words.json"))
+_ANY_ACCOUNT = "*"
+
+
+def _key(handle, word) -> str:
+    return f"{handle}\t{unicodedata.normalize('NFC', word.strip())}"
+
+
+class PostedWords:
+    """Words already posted, per account: an append-only log on disk mirrored by a set in memory"""
+
+    def __init__(self, path=None, seed_path=SEED_PATH):
+        self.path = path or os.path.join(DATA_DIR, "posted_words.log")
+        self._lock = threading.Lock()
+        self._keys: t.Set[str] = set()
+        try:
+            if seed_path and not os.path.exists(self.path):
+                self._seed(seed_path)
+            self._load()
+        except OSError as e:
+            # Still checked and recorded for the life of the process
+            logger.error("Failed to read the posted words log %s: %s", self.path, e)
+
+    def _seed(self, seed_path):
+        try:
+            with open(seed_path, encoding="utf-8") as f:
+                words = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logger.error("Ignoring unreadable seed %s: %s", seed_path, e)
+            return
+        lines = "".join(json.dumps({"handle": _ANY_ACCOUNT, "word": word}, ensure_ascii=False) + "\n" for word in words)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        logger.info("Posted words log seeded with %d words from %s", len(words), seed_path)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                # A crash cut the last append short; drop it so the next one starts on a fresh line
+                logger.error("Dropping a torn record at the end of %s", self.path)
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+                self._keys.add(_key(record["handle"], record["word"]))
+            except (ValueError, KeyError) as e:
+                logger.error("Skipping a bad record of %s: %s", self.path, e)
+
+    def seen(self, handle, word) -> bool:
+        """True when this account, or the seed, already posted the word"""
+        return _key(handle, word) in self._keys or _key(_ANY_ACCOUNT, word) in self._keys
+
+    def record(self, handle, word):
+        """Append a posted word to the log, synced to disk"""
+        record = {"handle": handle, "word": word, "posted_at": clock.now().isoformat(timespec="seconds")}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self._keys.add(_key(handle, word))
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                # One write on an O_APPEND descriptor: records never interleave, even across processes
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line)
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logger.error("Failed to append to the posted words log: %s", e)
+
+
+_default_log = None
+_default_lock = threading.Lock()
+
+
+def get_posted_words() -> PostedWords:
+    global _default_log
+    with _default_lock:
+        if _default_log is None:
+            _default_log = PostedWords()
+        return _default_log
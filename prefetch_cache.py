@@ -0,0 +1,113 @@
+import os
+import re
+import json
+import logging
+import typing as t
+from datetime import date, timedelta
+
+import clock
+from wiktionary_query import FALLBACK_YEAR
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+
+
+class PrefetchCache:
+    """Ready-to-post entries for upcoming days, one JSON file (+ thumbnail) per day"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(DATA_DIR, "prefetch")
+
+    def _folder(self, language, family):
+        slug = re.sub(r"\W+", "_", f"{language}_{family}").strip("_")
+        return os.path.join(self.directory, slug)
+
+    def _paths(self, language, family, day: date) -> t.Tuple[str, str]:
+        base = os.path.join(self._folder(language, family), day.isoformat())
+        return f"{base}.json", f"{base}.thumb"
+
+    def load(self, language, family, day: date) -> t.Optional[t.Dict[str, t.Any]]:
+        """Return the cached entry for a day, None on a miss"""
+        entry_path, thumb_path = self._paths(language, family, day)
+        try:
+            with open(entry_path, encoding="utf-8") as f:
+                entry = json.load(f)
+            entry["thumb"] = None
+            if entry.get("has_thumb"):
+                with open(thumb_path, "rb") as f:
+                    entry["thumb"] = f.read()
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error("Unreadable prefetch entry %s: %s", entry_path, e)
+            return None
+
+    def store(self, language, family, day: date, page_name, word_data, og_title, thumb: t.Optional[bytes]):
+        """Write an entry; the JSON file is replaced last so readers never see half an entry"""
+        entry_path, thumb_path = self._paths(language, family, day)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        if thumb:
+            self._write_atomic(thumb_path, thumb)
+        entry = {
+            "page_name": page_name,
+            "word_data": word_data,
+            "og_title": og_title,
+            "has_thumb": bool(thumb),
+            "fetched_at": clock.now().isoformat(timespec="seconds"),
+        }
+        self._write_atomic(entry_path, json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+
+    def prune(self, before: date):
+        """Drop entries of days already past"""
+        if not os.path.isdir(self.directory):
+            return
+        for folder in os.listdir(self.directory):
+            for name in os.listdir(os.path.join(self.directory, folder)):
+                if name.split(".")[0] < before.isoformat():
+                    os.remove(os.path.join(self.directory, folder, name))
+
+    @staticmethod
+    def _write_atomic(path, payload: bytes):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+
+def prefetch_day(bot, cache: PrefetchCache, day: date) -> bool:
+    """Resolve, parse and download everything a bot needs to post on a given day"""
+    cached = cache.load(bot.language, bot.template_family, day)
+    if cached and f"/{FALLBACK_YEAR}/" not in cached["page_name"]:
+        # Current-year entries do not change; fallback ones are retried in case today's gets written
+        return True
+
+    page_name = bot.get_today_word(day)
+    if page_name is None:
+        return False
+    word_data = bot.get_word_data(page_name)
+    if not word_data:
+        return False
+
+    try:
+        og_title, thumb = bot.get_link_card(word_data["url"])
+    except Exception as e:
+        logger.error("Failed to prefetch the link card for %s: %s", page_name, e)
+        return False
+
+    cache.store(bot.language, bot.template_family, day, page_name, word_data, og_title, thumb)
+    logger.info("Prefetched <%s> for %s", page_name, day.isoformat())
+    return True
+
+
+def prefetch_upcoming(bot, cache: PrefetchCache, days: int) -> int:
+    """Prefetch today and the next days, return how many are ready"""
+    today = clock.today()
+    cache.prune(today)
+    ready = 0
+    for offset in range(days):
+        if prefetch_day(bot, cache, today + timedelta(days=offset)):
+            ready += 1
+    logger.info("Prefetch done for %s: %s/%s days ready", bot.template_family, ready, days)
+    return ready
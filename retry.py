@@ -0,0 +1,380 @@
+import os
+import time
+import sys
+import random
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+import typing as t
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+# Wall-clock budget of one run, retries included
+RUN_TIME_BUDGET = float(os.getenv("RUN_TIME_BUDGET", "120"))
+# Consecutive transient failures that open a host's circuit, and how long it stays open
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "60"))
+# Calls kept in reserve: below this many left in a rate-limit window, writes wait for its reset
+RATE_LIMIT_RESERVE = int(os.getenv("RATE_LIMIT_RESERVE", "1"))
+# Requests per second to each Wiktionary host, whatever the number of feeds, and the burst allowed above it
+WIKTIONARY_RATE = float(os.getenv("WIKTIONARY_RATE", "10"))
+WIKTIONARY_BURST = int(os.getenv("WIKTIONARY_BURST", "10"))
+
+_TRANSIENT_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+# Failures after which a request is known not to have reached the server
+_NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_deadline: contextvars.ContextVar[t.Optional[float]] = contextvars.ContextVar("retry_deadline", default=None)
+
+
+class CircuitOpenError(Exception):
+    """A host failed too often lately, calls to it fail fast until it cools down"""
+
+
+class MaxlagError(Exception):
+    """MediaWiki asked us to back off because its replicas are lagging"""
+
+    def __init__(self, retry_after: t.Optional[float]):
+        super().__init__(f"Server lagged, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker of one host"""
+
+    def __init__(self, host: str, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: t.Optional[float] = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown:
+                raise CircuitOpenError(f"Circuit open for {self.host}")
+            # Past the cooldown the next call is a trial; one more failure opens the circuit again
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error("Opening the circuit for %s after %d failures", self.host, self.failures)
+                self.opened_at = time.monotonic()
+
+
+_breakers: t.Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+
+class TokenBucket:
+    """Requests to one host: rate per second on average, burst at once; callers over it wait their turn"""
+
+    def __init__(self, rate: float = WIKTIONARY_RATE, burst: int = WIKTIONARY_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, possibly one not refilled yet, and return how long to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+_buckets: t.Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def limit_host(host: str, rate: float = WIKTIONARY_RATE, burst: int = WIKTIONARY_BURST):
+    """Rate-limit the calls to a host made through call_with_retry, shared by every caller in the process"""
+    if rate <= 0:
+        return
+    with _buckets_lock:
+        if host not in _buckets:
+            _buckets[host] = TokenBucket(rate, burst)
+
+
+def _throttle_delay(host: str) -> float:
+    bucket = _buckets.get(host)
+    return bucket.reserve() if bucket is not None else 0.0
+
+
+def host_of(url: str) -> str:
+    return httpx.URL(url).host
+
+
+def parse_retry_after(value: t.Optional[str]) -> t.Optional[float]:
+    """Seconds to wait from a Retry-After header, given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _header(headers: t.Mapping[str, str], name: str) -> t.Optional[str]:
+    # atproto hands headers over as a plain dict, in whatever case the server used
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _atproto_error(exc: BaseException) -> bool:
+    # Looked up rather than imported: an atproto error can only exist once atproto was loaded by a stage
+    exceptions = sys.modules.get("atproto_client.exceptions")
+    return exceptions is not None and isinstance(exc, exceptions.RequestErrorBase)
+
+
+def describe_error(exc: BaseException) -> str:
+    """Status and server message of a failed call, for the logs, rather than the whole response it carries"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return f"HTTP {exc.response.status_code}"
+    if _atproto_error(exc) and exc.response is not None:
+        content = exc.response.content
+        if isinstance(content, dict):
+            error, message = content.get("error"), content.get("message")
+        else:
+            error, message = getattr(content, "error", None), getattr(content, "message", None)
+        status = f"HTTP {exc.response.status_code}"
+        return f"{status} {error}: {message}" if error and message else " ".join(filter(None, (status, error)))
+    if _atproto_error(exc) and exc.__cause__ is not None:
+        # atproto wraps the httpx error it got, with no message of its own
+        exc = exc.__cause__
+    return str(exc) or type(exc).__name__
+
+
+def _rate_limit_reset(headers: t.Mapping[str, str]) -> t.Optional[float]:
+    """Seconds until the rate-limit window of a response resets, from its RateLimit-Reset epoch"""
+    value = _header(headers, "ratelimit-reset")
+    try:
+        return max(0.0, float(value) - time.time()) if value else None
+    except ValueError:
+        return None
+
+
+# (calls left, epoch of the window reset) last reported by each host
+_rate_limits: t.Dict[str, t.Tuple[int, float]] = {}
+_rate_limits_lock = threading.Lock()
+
+
+def note_rate_limit(host: str, headers: t.Mapping[str, str]):
+    """Remember the RateLimit-* headers of a response, shared by every account and bot of the process"""
+    remaining, reset = _header(headers, "ratelimit-remaining"), _header(headers, "ratelimit-reset")
+    if remaining is None or reset is None:
+        return
+    try:
+        with _rate_limits_lock:
+            _rate_limits[host] = (int(remaining), float(reset))
+    except ValueError:
+        pass
+
+
+def rate_limit_delay(host: str) -> float:
+    """Seconds to hold writes to a host for, 0 while its rate-limit window has room"""
+    with _rate_limits_lock:
+        remaining, reset = _rate_limits.get(host, (RATE_LIMIT_RESERVE, 0.0))
+    if remaining >= RATE_LIMIT_RESERVE:
+        return 0.0
+    return max(0.0, reset - time.time())
+
+
+def classify(exc: BaseException, idempotent: bool = True) -> t.Tuple[bool, t.Optional[float]]:
+    """(is worth retrying, server-requested delay) of a failed call
+
+    Calls that are not idempotent are only retried when the request surely did not
+    take effect: it never reached the server, or the server rate-limited it.
+    """
+    if isinstance(exc, MaxlagError):
+        return True, exc.retry_after
+
+    status, headers = None, {}
+    if isinstance(exc, httpx.HTTPStatusError):
+        status, headers = exc.response.status_code, exc.response.headers
+    elif _atproto_error(exc) and exc.response is not None:
+        status, headers = exc.response.status_code, exc.response.headers
+    elif _atproto_error(exc):
+        # atproto wraps the httpx error it got
+        exc = exc.__cause__ or exc
+
+    if status is not None:
+        delay = parse_retry_after(_header(headers, "retry-after"))
+        if delay is None and status == 429:
+            # The PDS tells when its window resets rather than sending Retry-After
+            delay = _rate_limit_reset(headers)
+        if status == 429:
+            return True, delay
+        return idempotent and status in _TRANSIENT_STATUSES, delay
+
+    if isinstance(exc, _NOT_SENT):
+        return True, None
+    return idempotent and isinstance(exc, httpx.TransportError), None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def remaining_budget() -> t.Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _next_delay(exc, attempt, idempotent, what, max_delay=None) -> t.Optional[float]:
+    """Delay before the next attempt, None to give up"""
+    transient, requested = classify(exc, idempotent)
+    if not transient or attempt + 1 >= RETRY_ATTEMPTS:
+        return None
+    delay = requested if requested is not None else backoff_delay(attempt)
+    if max_delay is not None and delay > max_delay:
+        # The caller has a better use of the wait than sleeping through it
+        return None
+    remaining = remaining_budget()
+    if remaining is not None and delay >= remaining:
+        logger.error("No time budget left to retry %s", what)
+        return None
+    logger.warning("%s failed, retrying in %.1f s: %s", what, delay, describe_error(exc))
+    get_metrics().add_retry()
+    return delay
+
+
+def _record(breaker, exc, idempotent):
+    if classify(exc, idempotent)[0] and not isinstance(exc, MaxlagError):
+        breaker.record_failure()
+
+
+def call_with_retry(fn: t.Callable[..., t.Any], *args, host: str, idempotent: bool = True,
+                    max_delay: t.Optional[float] = None, **kwargs):
+    """Call fn, retrying transient failures within the attempt count and the run budget
+
+    A failure asking for a longer wait than max_delay (rate limit, Retry-After) is raised instead.
+    """
+    breaker = get_breaker(host)
+    what = f"{getattr(fn, '__name__', 'call')} on {host}"
+    attempt = 0
+    while True:
+        breaker.before_call()
+        wait = _throttle_delay(host)
+        if wait:
+            time.sleep(wait)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            _record(breaker, e, idempotent)
+            delay = _next_delay(e, attempt, idempotent, what, max_delay)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+
+async def async_call_with_retry(fn: t.Callable[..., t.Awaitable[t.Any]], *args, host: str, idempotent: bool = True,
+                                max_delay: t.Optional[float] = None, **kwargs):
+    """Async counterpart of call_with_retry"""
+    breaker = get_breaker(host)
+    what = f"{getattr(fn, '__name__', 'call')} on {host}"
+    attempt = 0
+    while True:
+        breaker.before_call()
+        wait = _throttle_delay(host)
+        if wait:
+            await asyncio.sleep(wait)
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            _record(breaker, e, idempotent)
+            delay = _next_delay(e, attempt, idempotent, what, max_delay)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+
+def check_response(response: httpx.Response) -> httpx.Response:
+    """Raise on error statuses, and on MediaWiki's maxlag refusal which may come with a 200"""
+    if response.headers.get("MediaWiki-API-Error") == "maxlag":
+        raise MaxlagError(parse_retry_after(response.headers.get("Retry-After")))
+    return response.raise_for_status()
+
+
+def get_with_retry(http_client: httpx.Client, url: str, **kwargs) -> httpx.Response:
+    """GET with retries, the response status already checked"""
+    def get():
+        return check_response(http_client.get(url, **kwargs))
+    return call_with_retry(get, host=host_of(url))
+
+
+async def async_get_with_retry(http_client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+    """Async counterpart of get_with_retry"""
+    async def get():
+        return check_response(await http_client.get(url, **kwargs))
+    return await async_call_with_retry(get, host=host_of(url))
+
+
+def run_budget(seconds: float = RUN_TIME_BUDGET):
+    """Decorate a run method so that all its retries fit in seconds of wall-clock time"""
+
+    def decorator(method):
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(*args, **kwargs):
+                token = _deadline.set(time.monotonic() + seconds)
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    _deadline.reset(token)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            token = _deadline.set(time.monotonic() + seconds)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                _deadline.reset(token)
+        return wrapper
+
+    return decorator
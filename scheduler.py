@@ -1,38 +1,256 @@
-import schedule
-import time
+import os
+import json
+import signal
+import asyncio
 import logging
-from wiktionary_bluesky_bot import WiktionaryBlueskyBot
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("scheduler.log"),
-        logging.StreamHandler()
-    ]
-)
+import functools
+import threading
+import typing as t
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from dotenv import load_dotenv
+
+# The scheduler is the service itself: its settings are loaded before the modules below read them
+load_dotenv()
+
+import clock
+from feeds import build_bots, load_feeds, run_feeds
+from prefetch_cache import PrefetchCache, prefetch_upcoming
+from http_client import build_async_http_client, close_http_client, get_http_client
+from metrics import serve_metrics, write_summary
+from oneshot import configure
+
 logger = logging.getLogger(__name__)
 
-def run_bot():
-    """Run the Wiktionary Bluesky Bot"""
-    logger.info("Scheduled job: Running Wiktionary Bluesky Bot")
-    bot = WiktionaryBlueskyBot()
-    success = bot.run()
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+
+# One connection pool for the whole process, kept alive between runs
+http_client = get_http_client()
+
+# One event loop, and the pool bound to it, for the whole process: used by the feeds job,
+# and by every feed in async mode
+use_async = os.getenv("BOT_ASYNC") == "1"
+loop = asyncio.new_event_loop()
+async_http_client = build_async_http_client()
+
+# Entries for the coming days are prepared off-peak, the 10:00 run only posts
+prefetch_cache = PrefetchCache()
+PREFETCH_DAYS = int(os.getenv("PREFETCH_DAYS", "7"))
+PREFETCH_TIME = os.getenv("PREFETCH_TIME", "03:00")
+
+# Daily jobs as "name@HH:MM[@Time/Zone]", comma-separated, run in this order when several are due
+SCHEDULER_JOBS = os.getenv("SCHEDULER_JOBS", f"prefetch@{PREFETCH_TIME},bot@10:00")
+DEFAULT_TZ = os.getenv("SCHEDULER_TZ", os.getenv("TZ", "UTC"))
+# Jobs with a warm-up get their connections, session and post ready this long before their slot.
+# Kept under the pool's keepalive expiry so that the warmed connections are still open at the slot.
+WARMUP_SECONDS = float(os.getenv("WARMUP_SECONDS", "30"))
+# A slot missed while the scheduler was down is still run if it is at most this old
+CATCHUP_WINDOW = timedelta(hours=float(os.getenv("SCHEDULER_CATCHUP_HOURS", "12")))
+STATE_PATH = os.path.join(DATA_DIR, "scheduler_state.json")
+
+# Prometheus scrapes /metrics; the last run is also summarized in the data volume
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+RUN_SUMMARY_PATH = os.path.join(DATA_DIR, "run_summary.json")
+
+# One bot per feed, living as long as the process with its Bluesky client and session
+bots = build_bots(load_feeds(), http_client=http_client, async_http_client=async_http_client,
+                  prefetch_cache=prefetch_cache)
+
+stop = threading.Event()
+
+
+class Job:
+    """A daily job at a wall-clock time of its own time zone"""
+
+    def __init__(self, name: str, at: str, tz: str):
+        self.name = name
+        self.at = dt_time.fromisoformat(at)
+        self.tz = ZoneInfo(tz)
+
+    def _slot(self, day: date) -> datetime:
+        return datetime.combine(day, self.at, tzinfo=self.tz)
+
+    def next_after(self, moment: datetime) -> datetime:
+        """First slot strictly after moment"""
+        local = moment.astimezone(self.tz)
+        slot = self._slot(local.date())
+        return slot if slot > local else self._slot(local.date() + timedelta(days=1))
+
+    def last_before(self, moment: datetime) -> datetime:
+        """Latest slot at or before moment"""
+        local = moment.astimezone(self.tz)
+        slot = self._slot(local.date())
+        return slot if slot <= local else self._slot(local.date() - timedelta(days=1))
+
+    def __repr__(self):
+        return f"{self.name}@{self.at.strftime('%H:%M')}@{self.tz.key}"
+
+
+def parse_jobs(spec: str) -> t.List[Job]:
+    jobs = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, at, *tz = item.split("@")
+        if name not in JOBS:
+            raise ValueError(f"Unknown job {name!r}, expected one of {sorted(JOBS)}")
+        jobs.append(Job(name, at, tz[0] if tz else DEFAULT_TZ))
+    return jobs
+
+
+def run_prefetch(day: t.Optional[date] = None):
+    """Prefetch the upcoming entries of every template family"""
+    logger.info("Scheduled job: Prefetching the next %d days", PREFETCH_DAYS)
+    for bot in bots.values():
+        try:
+            prefetch_upcoming(bot, prefetch_cache, PREFETCH_DAYS)
+        except Exception as e:
+            logger.error("Prefetch failed for %s: %s", type(bot).__name__, e)
+
+
+def run_feed(name: str, day: t.Optional[date] = None):
+    """Run one feed for a day, today by default"""
+    logger.info("Scheduled job: Running feed %s", name)
+    if use_async:
+        success = loop.run_until_complete(bots[name].run_async(day))
+    else:
+        success = bots[name].run(day)
     if success:
-        logger.info("Bot ran successfully")
+        logger.info("Feed %s ran successfully", name)
     else:
-        logger.error("Bot failed to run properly")
+        logger.error("Feed %s failed to run properly", name)
+    write_summary(RUN_SUMMARY_PATH)
+
+
+def run_all_feeds(day: t.Optional[date] = None):
+    """Run every feed at once, on the shared pools"""
+    logger.info("Scheduled job: Running feeds %s", list(bots))
+    loop.run_until_complete(run_feeds(bots, day))
+    write_summary(RUN_SUMMARY_PATH)
+
+
+def warm_up_feeds(*names: str, day: t.Optional[date] = None):
+    for name in names:
+        bots[name].warm_up(day)
+
+
+def drain_outboxes():
+    """Send the posts left in the outbox by failed or rate-limited runs, once their retry is due"""
+    for bot in bots.values():
+        try:
+            if bot.drain_outbox():
+                write_summary(RUN_SUMMARY_PATH)
+        except Exception as e:
+            logger.error("Outbox drain failed for %s: %s", type(bot).__name__, e)
+
+
+# Each feed is a job of its own name, "feeds" runs them all at once
+if {"prefetch", "feeds"} & set(bots):
+    raise ValueError("A feed cannot be named prefetch or feeds")
+JOBS = {"prefetch": run_prefetch, "feeds": run_all_feeds,
+        **{name: functools.partial(run_feed, name) for name in bots}}
+WARMUPS = {"feeds": functools.partial(warm_up_feeds, *bots),
+           **{name: functools.partial(warm_up_feeds, name) for name in bots}}
+
+
+def load_state() -> t.Dict[str, str]:
+    """Slot of the last run of each job"""
+    try:
+        with open(STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error("Ignoring unreadable scheduler state %s: %s", STATE_PATH, e)
+        return {}
+
+
+def save_state(state: t.Dict[str, str]):
+    try:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        tmp_path = f"{STATE_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, STATE_PATH)
+    except OSError as e:
+        logger.error("Failed to save the scheduler state: %s", e)
+
+
+def run_job(job: Job, slot: datetime, state: t.Dict[str, str]):
+    late = (clock.now(timezone.utc) - slot).total_seconds()
+    logger.info("Running %r for its %s slot, %.3f s late", job, slot.isoformat(), late)
+    try:
+        # The entry of the slot's own day: a slot caught up after midnight still posts the word it missed
+        JOBS[job.name](day=slot.date())
+    except Exception as e:
+        logger.error("Job %r failed: %s", job, e)
+    state[job.name] = slot.isoformat()
+    save_state(state)
+
+
+def warm_up_job(job: Job, slot: datetime):
+    logger.info("Warming up %r for its %s slot", job, slot.isoformat())
+    try:
+        WARMUPS[job.name](day=slot.date())
+    except Exception as e:
+        logger.error("Warm-up of %r failed: %s", job, e)
+
+
+def main():
+    configure("scheduler.log")
+    jobs = parse_jobs(SCHEDULER_JOBS)
+    state = load_state()
+    logger.info("Scheduler started with jobs %s", jobs)
+
+    if METRICS_PORT:
+        serve_metrics(METRICS_HOST, METRICS_PORT)
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    # Run what was missed while the scheduler was down, a fresh install included, within the catch-up window
+    now = clock.now(timezone.utc)
+    for job in jobs:
+        slot = job.last_before(now)
+        last = state.get(job.name)
+        if now - slot <= CATCHUP_WINDOW and (last is None or datetime.fromisoformat(last) < slot):
+            run_job(job, slot, state)
+
+    upcoming = {job.name: job.next_after(clock.now(timezone.utc)) for job in jobs}
+    # Slot each job was last warmed up for
+    warmed: t.Dict[str, datetime] = {}
+    warmup = timedelta(seconds=WARMUP_SECONDS)
 
-# Schedule the bot to run daily at a specific time (e.g., 10:00 AM)
-schedule.every().day.at("10:00").do(run_bot)
+    def next_event(job):
+        """(moment, is a warm-up) of the job's next event"""
+        slot = upcoming[job.name]
+        if job.name in WARMUPS and WARMUP_SECONDS > 0 and warmed.get(job.name) != slot:
+            return slot - warmup, True
+        return slot, False
 
-logger.info("Scheduler started. Bot will run daily at 10:00 AM")
+    try:
+        while not stop.is_set():
+            job = min(jobs, key=lambda j: next_event(j)[0])
+            moment, is_warmup = next_event(job)
+            remaining = (moment - clock.now(timezone.utc)).total_seconds()
+            if remaining > 0:
+                # Pending posts are retried between jobs, at most a minute after they are due
+                drain_outboxes()
+                # Capped so that a clock change or a suspend is noticed within a minute
+                clock.wait(stop, min(remaining, 60))
+                continue
+            if is_warmup:
+                warm_up_job(job, upcoming[job.name])
+                warmed[job.name] = upcoming[job.name]
+                continue
+            run_job(job, upcoming[job.name], state)
+            upcoming[job.name] = job.next_after(clock.now(timezone.utc))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Scheduler stopping")
+        loop.run_until_complete(async_http_client.aclose())
+        loop.close()
+        close_http_client()
 
-# Run the bot immediately on first execution
-run_bot()
 
-# Keep the script running
-while True:
-    schedule.run_pending()
-    time.sleep(60)  # Check every minute
+if __name__ == "__main__":
+    main()
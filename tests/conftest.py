@@ -0,0 +1,129 @@
+import os
+import sys
+import tempfile
+
+# The modules read their settings at import time: keep them off /app/data and away from the network
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="wiktionary-bot-tests-")
+os.environ.setdefault("WIKTIONARY_LANGUAGE", "fr")
+os.environ["WIKTIONARY_RATE"] = "0"
+os.environ["POSTED_WORDS_SEED"] = ""
+
+import json
+import hashlib
+import time as _time
+import typing as t
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+DID = "did:plc:testbot"
+HANDLE = "bot.bsky.test"
+
+
+class FakePDS:
+    """A PDS behind an httpx.MockTransport: it keeps records and blobs, and fails the calls a test queues up"""
+
+    def __init__(self):
+        from atproto import Client, models
+        from atproto_request import SharedRequest
+
+        self.records: t.Dict[t.Tuple[str, str], t.Dict[str, t.Any]] = {}
+        self.blobs: t.Set[str] = set()
+        # (method name, JSON body) of every call, in order
+        self.calls: t.List[t.Tuple[str, t.Any]] = []
+        self._failures: t.List[t.Dict[str, t.Any]] = []
+        self.client = Client("https://pds.test",
+                             request=SharedRequest(httpx.Client(transport=httpx.MockTransport(self._handle))))
+        self.client.me = models.AppBskyActorDefs.ProfileViewDetailed(did=DID, handle=HANDLE)
+
+    def fail(self, method: str, status: int, headers: t.Optional[t.Dict[str, str]] = None, written: bool = False):
+        """Answer the next call to method with status; written makes it take effect all the same (a lost response)"""
+        self._failures.append({"method": method, "status": status, "headers": headers or {}, "written": written})
+
+    def collect_garbage(self):
+        """Drop the blobs no record references"""
+        self.blobs = {link for link in self.blobs if any(link in json.dumps(value) for value in self.records.values())}
+
+    def calls_to(self, method: str) -> t.List[t.Any]:
+        return [body for name, body in self.calls if name == method]
+
+    @staticmethod
+    def _json(status: int, payload: t.Dict[str, t.Any], headers=None) -> httpx.Response:
+        # atproto only parses bodies of this exact content type
+        return httpx.Response(status, content=json.dumps(payload).encode("utf-8"),
+                              headers={**(headers or {}), "Content-Type": "application/json; charset=utf-8"})
+
+    def _error(self, status: int, error: str, headers=None) -> httpx.Response:
+        return self._json(status, {"error": error, "message": error}, headers)
+
+    def _handle(self, request: httpx.Request) -> httpx.Response:
+        # The last part of the NSID, such as createRecord
+        method = request.url.path.rsplit(".", 1)[-1]
+        body = request.content
+        if body and request.headers.get("content-type", "").startswith("application/json"):
+            body = json.loads(body)
+        self.calls.append((method, body))
+
+        failure = next((f for f in self._failures if f["method"] == method), None)
+        if failure is not None:
+            self._failures.remove(failure)
+            if failure["written"]:
+                self._route(method, request, body)
+            return self._error(failure["status"], "Failure", failure["headers"])
+        response = self._route(method, request, body)
+        return response if response is not None else self._error(501, "MethodNotImplemented")
+
+    def _route(self, method, request, body) -> t.Optional[httpx.Response]:
+        from dag_cbor import record_cid
+
+        if method == "uploadBlob":
+            link = record_cid({"sha256": hashlib.sha256(body).hexdigest()})
+            self.blobs.add(link)
+            return self._json(200, {"blob": {"$type": "blob", "ref": {"$link": link},
+                                             "mimeType": request.headers["content-type"], "size": len(body)}})
+        if method == "createRecord":
+            return self._write([body]) or self._json(200, self._ref(body["collection"], body["rkey"]))
+        if method == "applyWrites":
+            return self._write(body["writes"]) or self._json(200, {})
+        if method == "getRecord":
+            params = {key: values[-1] for key, values in parse_qs(request.url.query.decode()).items()}
+            value = self.records.get((params["collection"], params["rkey"]))
+            if value is None:
+                return self._error(400, "RecordNotFound")
+            return self._json(200, dict(self._ref(params["collection"], params["rkey"]), value=value))
+        return None
+
+    def _write(self, writes) -> t.Optional[httpx.Response]:
+        for write in writes:
+            thumb = write["record" if "record" in write else "value"].get("embed", {}).get("external", {}).get("thumb")
+            if thumb and thumb["ref"]["$link"] not in self.blobs:
+                return self._error(400, "BlobNotFound")
+        for write in writes:
+            self.records[(write["collection"], write["rkey"])] = write.get("record", write.get("value"))
+        return None
+
+    def _ref(self, collection: str, rkey: str) -> t.Dict[str, str]:
+        from dag_cbor import record_cid
+
+        return {"uri": f"at://{DID}/{collection}/{rkey}", "cid": record_cid(self.records[(collection, rkey)])}
+
+
+@pytest.fixture
+def pds():
+    import retry
+
+    # Failures from other tests must not leave the PDS' breaker open
+    retry._breakers.clear()
+    return FakePDS()
+
+
+@pytest.fixture
+def virtual_clock():
+    import clock
+
+    virtual = clock.VirtualClock(_time.time())
+    clock.set_clock(virtual)
+    yield virtual
+    clock.set_clock(clock.Clock())
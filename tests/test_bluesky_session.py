@@ -0,0 +1,62 @@
+import json
+import base64
+import threading
+
+import httpx
+
+import bluesky_session
+from bluesky_session import SessionStore, forget_bluesky_client, get_bluesky_client
+
+
+def _jwt(did):
+    def part(payload):
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).rstrip(b"=").decode()
+    return f"{part({'alg': 'none'})}.{part({'sub': did, 'exp': 4102444800})}.c2ln"
+
+
+class SlowPDS:
+    """Answers logins, holding those of one account until released"""
+
+    def __init__(self, slow_handle):
+        self.slow_handle = slow_handle
+        self.slow_login_started = threading.Event()
+        self.release = threading.Event()
+        self.client = httpx.Client(transport=httpx.MockTransport(self._handle))
+
+    def _handle(self, request: httpx.Request) -> httpx.Response:
+        method = request.url.path.rsplit(".", 1)[-1]
+        if method == "createSession":
+            handle = json.loads(request.content)["identifier"]
+            if handle == self.slow_handle:
+                self.slow_login_started.set()
+                self.release.wait(5)
+            did = f"did:plc:{handle.split('.')[0]}"
+            payload = {"did": did, "handle": handle, "accessJwt": _jwt(did), "refreshJwt": _jwt(did)}
+        elif method == "getProfile":
+            actor = request.url.params["actor"]
+            payload = {"did": actor, "handle": actor.split(":")[-1] + ".bsky.test"}
+        else:
+            return httpx.Response(501)
+        return httpx.Response(200, content=json.dumps(payload).encode(),
+                              headers={"Content-Type": "application/json; charset=utf-8"})
+
+
+def test_slow_login_does_not_hold_up_other_accounts(tmp_path, monkeypatch):
+    monkeypatch.setattr(bluesky_session, "PDS_URL", "https://pds.test")
+    pds = SlowPDS("slow.bsky.test")
+    store = SessionStore(str(tmp_path))
+    slow = threading.Thread(target=get_bluesky_client, args=("slow.bsky.test", "pw", pds.client, store))
+    slow.start()
+    try:
+        assert pds.slow_login_started.wait(5)
+        done = threading.Event()
+        fast = threading.Thread(target=lambda: (get_bluesky_client("fast.bsky.test", "pw", pds.client, store),
+                                                done.set()))
+        fast.start()
+        assert done.wait(2), "the login of another account waited for the slow one"
+        fast.join()
+    finally:
+        pds.release.set()
+        slow.join(5)
+        forget_bluesky_client("slow.bsky.test")
+        forget_bluesky_client("fast.bsky.test")
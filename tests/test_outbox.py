@@ -0,0 +1,148 @@
+import os
+import logging
+from datetime import date
+
+import pytest
+
+import outbox
+from blob_cache import BlobCache
+from conftest import HANDLE
+
+THUMB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench", "fixtures", "thumb.png")
+
+
+@pytest.fixture
+def box(tmp_path):
+    queue = outbox.Outbox(str(tmp_path / "outbox.sqlite"))
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def blob_cache(tmp_path):
+    return BlobCache(str(tmp_path / "blobs.json"))
+
+
+def _enqueue(box, pds=None, image=None):
+    embed = None
+    if image is not None:
+        blob = pds.client.upload_blob(image).blob
+        embed = {"$type": "app.bsky.embed.external",
+                 "external": {"uri": "https://fr.wiktionary.org/wiki/douanier", "title": "douanier",
+                              "description": "", "thumb": blob.model_dump(mode="json", by_alias=True)}}
+    rkey = outbox.post_rkey(date(2026, 10, 17), HANDLE, "Entrée du jour")
+    box.enqueue(HANDLE, rkey, "douanier", "📚 douanier", embed, image)
+    return rkey
+
+
+def _thumb():
+    with open(THUMB_PATH, "rb") as f:
+        return f.read()
+
+
+def test_lost_response_is_looked_up_not_posted_again(pds, box, blob_cache):
+    rkey = _enqueue(box)
+    pds.fail("createRecord", 502, written=True)
+
+    sent = box.drain(HANDLE, pds.client, blob_cache)
+
+    assert [post["rkey"] for post in sent] == [rkey]
+    assert box.status(HANDLE, rkey) == "sent"
+    assert len(pds.calls_to("createRecord")) == 1
+    assert len(pds.records) == 1
+
+
+def test_unsent_post_is_retried_on_a_later_drain(pds, box, blob_cache, virtual_clock):
+    rkey = _enqueue(box)
+    pds.fail("createRecord", 503)
+
+    assert box.drain(HANDLE, pds.client, blob_cache) == []
+    assert box.status(HANDLE, rkey) == "pending"
+    assert not box.due(HANDLE)
+
+    virtual_clock.advance(outbox.OUTBOX_RETRY_DELAY + 1)
+    assert [post["rkey"] for post in box.drain(HANDLE, pds.client, blob_cache)] == [rkey]
+    # The retry first checked that the failed attempt had not written the record after all
+    assert len(pds.calls_to("getRecord")) == 2
+    assert len(pds.records) == 1
+
+
+def test_rate_limited_post_waits_for_the_window(pds, box, blob_cache, virtual_clock):
+    rkey = _enqueue(box)
+    pds.fail("createRecord", 429, headers={"Retry-After": "600"})
+
+    assert box.drain(HANDLE, pds.client, blob_cache) == []
+    assert box.status(HANDLE, rkey) == "pending"
+    # Rescheduled for when the PDS asked, not retried in place
+    assert len(pds.calls_to("createRecord")) == 1
+    assert box.next_due(HANDLE) >= virtual_clock.time() + 590
+
+    virtual_clock.advance(300)
+    assert box.drain(HANDLE, pds.client, blob_cache) == []
+    virtual_clock.advance(301)
+    assert [post["rkey"] for post in box.drain(HANDLE, pds.client, blob_cache)] == [rkey]
+    assert len(pds.records) == 1
+
+
+def test_failed_post_is_sent_when_queued_again(pds, box, blob_cache):
+    rkey = _enqueue(box)
+    pds.fail("createRecord", 400)
+    assert box.drain(HANDLE, pds.client, blob_cache) == []
+    assert box.status(HANDLE, rkey) == "failed"
+
+    # Rendered again, by a manual run for instance
+    assert _enqueue(box) == rkey
+    assert box.status(HANDLE, rkey) == "pending"
+    assert [post["rkey"] for post in box.drain(HANDLE, pds.client, blob_cache)] == [rkey]
+    assert len(pds.records) == 1
+
+
+def test_sent_post_is_not_queued_again(pds, box, blob_cache):
+    rkey = _enqueue(box)
+    assert len(box.drain(HANDLE, pds.client, blob_cache)) == 1
+
+    _enqueue(box)
+    assert box.status(HANDLE, rkey) == "sent"
+    assert box.drain(HANDLE, pds.client, blob_cache) == []
+    assert len(pds.calls_to("createRecord")) == 1
+
+
+def test_failure_is_logged_without_the_response(pds, box, blob_cache, virtual_clock, caplog):
+    _enqueue(box)
+    pds.fail("createRecord", 503)
+
+    with caplog.at_level(logging.WARNING, logger="outbox"):
+        box.drain(HANDLE, pds.client, blob_cache)
+    assert "HTTP 503 Failure: Failure" in caplog.text
+    assert "headers" not in caplog.text
+
+
+def test_retry_uploads_the_thumbnail_again(pds, box, blob_cache, virtual_clock):
+    rkey = _enqueue(box, pds, _thumb())
+    pds.fail("createRecord", 503)
+    assert box.drain(HANDLE, pds.client, blob_cache) == []
+
+    # The blob was never referenced: by the next attempt the PDS has dropped it
+    pds.collect_garbage()
+    virtual_clock.advance(outbox.OUTBOX_RETRY_DELAY + 1)
+
+    assert [post["rkey"] for post in box.drain(HANDLE, pds.client, blob_cache)] == [rkey]
+    assert len(pds.calls_to("uploadBlob")) == 2
+    record = pds.records[(outbox.POST_COLLECTION, rkey)]
+    assert record["embed"]["external"]["thumb"]["ref"]["$link"] in pds.blobs
+
+
+def test_old_thumbnail_is_uploaded_again_before_the_first_attempt(pds, box, blob_cache, virtual_clock):
+    rkey = _enqueue(box, pds, _thumb())
+    pds.collect_garbage()
+    virtual_clock.advance(outbox.OUTBOX_BLOB_MAX_AGE + 1)
+
+    assert [post["rkey"] for post in box.drain(HANDLE, pds.client, blob_cache)] == [rkey]
+    assert len(pds.calls_to("uploadBlob")) == 2
+
+
+def test_fresh_thumbnail_is_not_uploaded_again(pds, box, blob_cache):
+    _enqueue(box, pds, _thumb())
+
+    assert len(box.drain(HANDLE, pds.client, blob_cache)) == 1
+    assert len(pds.calls_to("uploadBlob")) == 1
@@ -0,0 +1,100 @@
+import os
+from datetime import date, datetime, timezone
+
+import pytest
+
+import clock
+
+os.environ["METRICS_PORT"] = "0"
+
+
+class FakeFeed:
+    """Records the day each run and warm-up was for"""
+
+    def __init__(self):
+        self.runs = []
+        self.warm_ups = []
+
+    def run(self, day=None):
+        self.runs.append(day)
+        return True
+
+    def warm_up(self, day=None):
+        self.warm_ups.append(day)
+        return True
+
+    def drain_outbox(self):
+        return 0
+
+
+class StopAt(clock.VirtualClock):
+    def __init__(self, start: datetime, end: datetime):
+        super().__init__(start.timestamp())
+        self.end = end.timestamp()
+
+    def wait(self, event, seconds):
+        super().wait(event, seconds)
+        if self.time() >= self.end:
+            event.set()
+        return event.is_set()
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    import scheduler
+
+    feed = FakeFeed()
+    monkeypatch.setitem(scheduler.bots, "bot", feed)
+    monkeypatch.setattr(scheduler, "SCHEDULER_JOBS", "bot@10:00@UTC")
+    monkeypatch.setattr(scheduler, "STATE_PATH", str(tmp_path / "scheduler_state.json"))
+    monkeypatch.setattr(scheduler, "RUN_SUMMARY_PATH", str(tmp_path / "run_summary.json"))
+    monkeypatch.setattr(scheduler, "WARMUP_SECONDS", 30)
+    monkeypatch.setattr(scheduler, "use_async", False)
+    # main() closes the process' loop and pool when it returns
+    monkeypatch.setattr(scheduler, "loop", scheduler.asyncio.new_event_loop())
+    monkeypatch.setattr(scheduler, "close_http_client", lambda: None)
+    monkeypatch.chdir(tmp_path)
+    scheduler.stop.clear()
+    yield scheduler, feed
+    scheduler.stop.clear()
+    clock.set_clock(clock.Clock())
+
+
+def test_fresh_install_waits_for_the_next_slot(scheduler):
+    scheduler, feed = scheduler
+    # Yesterday's slot is older than the catch-up window: only today's entry is posted
+    clock.set_clock(StopAt(datetime(2026, 10, 17, 8, 0, tzinfo=timezone.utc),
+                           datetime(2026, 10, 17, 10, 5, tzinfo=timezone.utc)))
+
+    scheduler.main()
+
+    assert feed.runs == [date(2026, 10, 17)]
+    assert feed.warm_ups == [date(2026, 10, 17)]
+
+
+def test_caught_up_slot_posts_its_own_day(scheduler):
+    scheduler, feed = scheduler
+    scheduler.save_state({"bot": "2026-10-15T22:00:00+00:00"})
+    scheduler.SCHEDULER_JOBS = "bot@22:00@UTC"
+    # Restarted after midnight, within the catch-up window of the 22:00 slot it missed
+    clock.set_clock(StopAt(datetime(2026, 10, 17, 2, 0, tzinfo=timezone.utc),
+                           datetime(2026, 10, 17, 2, 5, tzinfo=timezone.utc)))
+
+    scheduler.main()
+
+    assert feed.runs == [date(2026, 10, 16)]
+
+
+def test_warm_up_before_midnight_prepares_the_slot_day(scheduler):
+    scheduler, feed = scheduler
+    scheduler.save_state({"bot": "2026-10-17T00:05:00+00:00"})
+    scheduler.SCHEDULER_JOBS = "bot@00:05@UTC"
+    # The 00:05 slot is warmed up at 23:55, the day before its own
+    scheduler.WARMUP_SECONDS = 600
+    clock.set_clock(StopAt(datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc),
+                           datetime(2026, 10, 18, 0, 10, tzinfo=timezone.utc)))
+
+    scheduler.main()
+
+    assert feed.warm_ups == [date(2026, 10, 18)]
+    assert feed.runs == [date(2026, 10, 18)]
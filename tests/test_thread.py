@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+import outbox
+from conftest import DID
+from dag_cbor import record_cid
+
+THUMB = {"$type": "blob", "ref": {"$link": record_cid({"thumb": 1})}, "mimeType": "image/png", "size": 1234}
+
+
+def _post(embed, replies):
+    return {"rkey": "3kabcdefghijk", "text": "📚 douanier", "embed": json.dumps(embed) if embed else None,
+            "replies": json.dumps(replies)}
+
+
+@pytest.mark.parametrize("embed", [
+    None,
+    {"$type": "app.bsky.embed.external",
+     "external": {"uri": "https://fr.wiktionary.org/wiki/douanier", "title": "douanier", "description": "",
+                  "thumb": THUMB}},
+])
+@pytest.mark.parametrize("replies", [["4 - Une définition de plus."], ["4 - Une.", "5 - Deux.", "6 - Trois."]])
+def test_reply_refs_match_the_records_sent(pds, embed, replies):
+    pds.blobs.add(THUMB["ref"]["$link"])
+    uri = outbox._create(pds.client, DID, _post(embed, replies))
+
+    sent = pds.calls_to("applyWrites")
+    assert len(sent) == 1
+    writes = sent[0]["writes"]
+    assert len(writes) == 1 + len(replies)
+    assert uri == f"at://{DID}/app.bsky.feed.post/{writes[0]['rkey']}"
+    # CIDs of the records as they went on the wire, which is what the PDS hashes
+    cids = [record_cid(write["value"]) for write in writes]
+    for index, write in enumerate(writes[1:], start=1):
+        reply = write["value"]["reply"]
+        assert reply["root"] == {"$type": "com.atproto.repo.strongRef", "cid": cids[0],
+                                 "uri": f"at://{DID}/app.bsky.feed.post/{writes[0]['rkey']}"}
+        assert reply["parent"]["cid"] == cids[index - 1]
+        assert reply["parent"]["uri"] == f"at://{DID}/app.bsky.feed.post/{writes[index - 1]['rkey']}"
+
+
+def test_thread_records_survive_another_serialization():
+    from atproto import models
+    from atproto_client.models.utils import get_model_as_json, get_or_create
+
+    writes = outbox._thread_writes(DID, _post(None, ["4 - Une.", "5 - Deux."]))
+    data = get_or_create({"repo": DID, "writes": writes}, models.ComAtprotoRepoApplyWrites.Data)
+    assert json.loads(get_model_as_json(data))["writes"] == writes
@@ -0,0 +1,41 @@
+from datetime import date
+
+from bench.standins import StandIn
+from wiktionary_query import NARROW_EXTRACT_CHARS, day_entry_titles, extract_params, first_extract, needs_full_extract
+
+
+def test_day_query_gets_the_current_year_entry():
+    # Both the current-year template and the fallback one exist
+    stand_in = StandIn(current_year_entries=True)
+    titles = day_entry_titles("Entrée du jour", date.today())
+    assert len(titles) == 2
+
+    data = stand_in.api(extract_params(titles))
+
+    assert "warnings" not in data
+    title, extract = first_extract(data, titles)
+    assert title == titles[0]
+    assert extract
+
+
+def test_single_title_query_gets_the_whole_page():
+    assert "exintro" not in extract_params(["douanier"], narrow=False)
+
+
+WORD_DATA = {"word": "douanier", "def_lines": ["1 - Agent des douanes."]}
+
+
+def test_short_extract_with_much_markup_is_not_fetched_again():
+    extract = ('<p><b>douanier</b> <span class="API" title="Prononciation API">\\dwa.nje\\</span> '
+               '<i>masculin</i></p>\n<ol><li><span class="term"><i>(Administration)</i></span> '
+               '<a href="/wiki/agent" title="agent">Agent</a> des <a href="/wiki/douane" title="douane">douanes</a>.'
+               '</li></ol>\n' * 8)
+    assert len(extract) >= NARROW_EXTRACT_CHARS
+
+    assert not needs_full_extract(extract, WORD_DATA)
+
+
+def test_cut_extract_is_fetched_again():
+    extract = "<p><b>douanier</b></p>\n<ol><li>Agent des douanes, chargé de contrôler…</li></ol>\n"
+
+    assert needs_full_extract(extract, WORD_DATA)
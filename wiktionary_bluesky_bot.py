@@ -1,177 +1,368 @@
-import requests
+import asyncio
 import os
-from datetime import datetime
 import logging
-from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-import time
 
 import re
 import typing as t
-import httpx
-from atproto import Client, models
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("wiktionary_bot.log"),
-        logging.StreamHandler()
-    ]
-)
+
+import clock
+from blob_cache import async_download_image, async_upload_thumb, download_image, get_blob_cache, upload_thumb
+from bluesky_session import PDS_HOST, PDS_URL, forget_bluesky_client, get_async_bluesky_client, get_bluesky_client
+from extract_parser import build_word_data, fit_word_data, reply_texts
+from http_client import async_fetch_html_head, build_async_http_client, fetch_html_head, get_http_client, resolve_hosts
+from lexicon import get_lexicon, lexicon_events, parse_day_template
+from log_setup import Clipped
+from metrics import get_metrics, timed_stage
+from outbox import PostNotSent, embed_dict, get_outbox, post_rkey, post_thumb
+from posted_words import get_posted_words
+from retry import (async_call_with_retry, async_get_with_retry, call_with_retry, get_with_retry, host_of, limit_host,
+                   run_budget)
+from wiktionary_query import (day_entry_titles, extract_params, first_extract, first_wikitext, info_params,
+                              needs_full_extract, page_revision, wikitext_params)
+from word_cache import get_word_cache
+
 logger = logging.getLogger(__name__)
 
+# Where definitions come from: TextExtracts' rendered HTML, or the page's wikitext parsed here
+BACKENDS = ("extracts", "wikitext")
+
 class WiktionaryBlueskyBot:
-    def __init__(self):
+    # Series of daily templates posted when the feed does not name one
+    default_template_family = "Entrée du jour"
+
+    def __init__(self, http_client=None, async_http_client=None, prefetch_cache=None, blob_cache=None, lexicon=None,
+                 posted_words=None, word_cache=None, outbox=None, name=None, language=None, template_family=None,
+                 handle=None, password=None, site_url=None, message_head=None, posting=True, backend=None):
+        """A feed: one language edition, one template family and one account, each defaulting to the environment"""
+        # Label of this feed in logs and metrics
+        self.name = name or type(self).__name__
+        # A feed that does not post yet still fetches and renders its entry, to try it out
+        self.posting = posting
 
         # Bluesky credentials
-        self.bluesky_handle = os.getenv("BLUESKY_HANDLE")
-        self.bluesky_password = os.getenv("BLUESKY_PASSWORD")
+        self.bluesky_handle = handle or os.getenv("BLUESKY_HANDLE")
+        self.bluesky_password = password or os.getenv("BLUESKY_PASSWORD")
         self.client = None
 
+        # Entries prepared ahead of time by the scheduler, if any
+        self.prefetch_cache = prefetch_cache
+        # Thumbnails already uploaded, by account and content hash
+        self.blob_cache = blob_cache or get_blob_cache()
+        # Pages already parsed, by revision; shared by the bots of the process
+        self.word_cache = word_cache or get_word_cache()
+        # Rendered posts waiting to be sent, kept across failures and restarts
+        self.outbox = outbox or get_outbox()
+        # Words this account already posted, checked before posting
+        self.posted_words = posted_words or get_posted_words()
+
+        # Pooled HTTP client, shared across bots and runs
+        self.http = http_client or get_http_client()
+        # Used by run_async; built per run when not provided
+        self.async_http = async_http_client
+        self.async_client = None
+
         # OG settings
         self._META_PATTERN = re.compile(r'<meta property="og:.*?>')
         self._CONTENT_PATTERN = re.compile(r'<meta[^>]+content="([^"]+)"')
 
         # Message settings
-        self.messageHead = "📚 Wiktionnaire - Le mot du jour est :\n\n"
+        self.messageHead = message_head or "📚 Wiktionnaire - Le mot du jour est : \n\n"
         self.blueskyMaxLength = 300
+        # Definitions past the first post go to replies instead of being cut
+        self.thread_overflow = os.getenv("BLUESKY_THREAD_OVERFLOW") == "1"
         
         # Wiktionary API settings
-        self.language = os.getenv("WIKTIONARY_LANGUAGE", os.getenv("WIKTIONARY_LANGUAGE"))
-        self.api_url = f"https://{self.language}.wiktionary.org/w/api.php"
-
+        self.language = language or os.getenv("WIKTIONARY_LANGUAGE")
+        self.site_url = site_url or os.getenv("WIKTIONARY_BASE_URL", f"https://{self.language}.wiktionary.org")
+        self.api_url = f"{self.site_url}/w/api.php"
+        self.template_family = template_family or self.default_template_family
+        self.backend = backend or os.getenv("WIKTIONARY_BACKEND", "extracts")
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {self.backend!r}, expected one of {BACKENDS}")
+        # Every feed of an edition shares its request rate
+        limit_host(host_of(self.site_url))
+        self._day_extracts = {}
+        # (day, post) rendered by warm_up ahead of the run
+        self._prepared = None
+        # Entries of a local Wiktionary dump, if one was built for this edition
+        self.lexicon = lexicon or get_lexicon(self.language)
+
+    @timed_stage("connect")
     def connect_to_bluesky(self):
         """Connect to Bluesky using API credentials"""
         try:
-            self.client = Client()
-            self.client.login(self.bluesky_handle, self.bluesky_password)
-            logger.info(f"Connected to Bluesky as {self.bluesky_handle}")
+            # Reuses the process' client or the stored session before logging in with the password
+            self.client = call_with_retry(get_bluesky_client, self.bluesky_handle, self.bluesky_password, self.http,
+                                          host=PDS_HOST)
+            logger.info("Connected to Bluesky as %s", self.bluesky_handle)
             return True
         except Exception as e:
-            logger.error(f"Failed to connect to Bluesky: {e}")
+            logger.error("Failed to connect to Bluesky: %s", e)
             return False
 
+    def _source_params(self, titles, narrow=True):
+        """Query for the extracts, or the wikitext, of titles"""
+        if self.backend == "wikitext":
+            # Wikitext always comes whole, and is smaller than even a narrow extract
+            return wikitext_params(titles, info=True)
+        return extract_params(titles, narrow)
+
+    def _first_source(self, data, titles):
+        """(title, extract or wikitext) of the first title that has one"""
+        if self.backend == "wikitext":
+            return first_wikitext(data, titles)
+        return first_extract(data, titles)
+
+    def _fetch_extract(self, word, narrow=True):
+        """Fetch (extract, revision) of a page, the extract None if the page has none
+
+        With the wikitext backend, the "extract" is the wikitext of the page.
+        """
+        response = get_with_retry(self.http, self.api_url, params=self._source_params([word], narrow))
+        data = response.json()
+        _, extract = self._first_source(data, [word])
+        return extract, page_revision(data, word)
+
+    def _needs_full_extract(self, extract, word_data):
+        return self.backend == "extracts" and needs_full_extract(extract, word_data)
+
+    def _word_cache_key(self, word):
+        # word_data also depends on the room the post leaves for the definitions, on what overflows,
+        # and on the parser that read it
+        return (f"{self.site_url}|{len(self.messageHead)}|{self.blueskyMaxLength}|{int(self.thread_overflow)}|"
+                f"{self.backend}|{word}")
+
+    def _cached_word_data(self, word):
+        """word_data of the current revision of a page if it was parsed before, checked with a page info request"""
+        key = self._word_cache_key(word)
+        if not self.word_cache.known(key):
+            # Nothing to compare with, the extract request brings the revision anyway
+            return None
+        response = get_with_retry(self.http, self.api_url, params=info_params([word]))
+        return self.word_cache.get(key, page_revision(response.json(), word))
+
+    @timed_stage("get_word_data")
     def get_word_data(self, word):
         """Get the definition of a specific word"""
         try:
-            params = {
-                "action": "query",
-                "prop": "extracts",
-                "exsectionformat": "plain",
-                "titles": word,
-                "format": "json"
-            }
-
-            sizeMessage = len(self.messageHead)
-
-            response = requests.get(self.api_url, params=params)
-            data = response.json()
-
-            page_id = next(iter(data["query"]["pages"]))
-            if page_id != "-1" and "extract" in data["query"]["pages"][page_id]:
-                extract = data["query"]["pages"][page_id]["extract"]
-
-                word_data = {}
-
-                soup = BeautifulSoup(extract, features="lxml")
-
-                title = soup.find('p').find('span').text
-                word_data["word"] = title
-                word_data["url"] = f"https://{self.language}.wiktionary.org/wiki/{title.replace(' ', '_')}"
-                logger.info(f" Title is : {title}")
-
-                first_line = soup.find('p').text.strip()
-                word_data["first_line"] = first_line
-                logger.info(f" First line is : {first_line}")
-                sizeMessage += len(first_line)
-                definition_list = soup.find('ol')
-                definitions = definition_list.find_all('li')
-                def_num = 1
-                overflow = False
-                word_data["def_lines"] = []
-
-                for definition in definitions:
-                    if definition.parent.name == "ol":
-                        logger.info(f"Current message size : {sizeMessage}")
-                        def_text_tab = definition.text.strip().split('\n')
-                        def_line = f"{def_num} - {def_text_tab[0]}"
-                        logger.info(f"Def_line is {def_line}")
-                        # Case when the definition is too long for bluesky
-
-                        cur_length = len(def_line)
-                        logger.info(f"Size of def_line is {cur_length}")
-                        if sizeMessage + cur_length > self.blueskyMaxLength:
-                            logger.info(f"Overflow detected")
-                            overflow = True
-
-                            buffer = self.blueskyMaxLength - sizeMessage - 7  # Maximal size for the def
-                            def_line = def_line[:buffer]
-                            def_line += "[…]"
-                            logger.info(f"Def_line is now {def_line}")
-                        word_data["def_lines"].append(def_line)
-                        sizeMessage += cur_length
-                        def_num += 1
-                        if overflow:
-                            break
-
-                logger.info(f"World_data is {word_data}")
-                return word_data
+            # get_today_word may already have fetched this extract
+            day_extract = self._day_extracts.pop(word, None)
+            if day_extract is None:
+                word_data = self._lexicon_word_data(word) or self._cached_word_data(word)
+                if word_data:
+                    return word_data
+                extract, revision = self._fetch_extract(word)
+            else:
+                extract, revision = day_extract
+                word_data = self.word_cache.get(self._word_cache_key(word), revision)
+                if word_data:
+                    return word_data
+
+            if extract is not None:
+                try:
+                    word_data = self._parse_extract(extract)
+                except ValueError:
+                    word_data = None
+
+                if self._needs_full_extract(extract, word_data):
+                    # The narrow extract may stop before the definitions that would fit
+                    logger.info("Fetching the full extract of <%s>", word)
+                    extract, revision = self._fetch_extract(word, narrow=False)
+                    if extract is not None:
+                        word_data = self._parse_extract(extract)
+
+                if word_data:
+                    self.word_cache.put(self._word_cache_key(word), revision, word_data)
+                    return word_data
 
             raise ValueError('Definition not found')
 
         except Exception as e:
-            logger.error(f"Error fetching definition for word '{word}': {e}")
+            logger.error("Error fetching definition for word '%s': %s", word, e)
             return None
 
-    def post_to_bluesky(self, word_data):
-        """Post the word of the day to Bluesky"""
+    def _parse_extract(self, extract):
+        """Build word_data from an extract, or wikitext, within the post length budget"""
+        if self.backend == "wikitext":
+            return self._parse_wikitext(extract)
+        word_data = build_word_data(extract, self.site_url, len(self.messageHead), self.blueskyMaxLength,
+                                    self.thread_overflow)
+        logger.debug("World_data is %s", Clipped(word_data))
+        return word_data
+
+    def _parse_wikitext(self, wikitext):
+        """Build word_data from the wikitext of a day template: its headword line and "#" definitions"""
+        entry = parse_day_template(wikitext, self.language or "fr")
+        if entry is None:
+            raise ValueError("No definitions in the wikitext")
+        word_data = fit_word_data(lexicon_events(entry), self.site_url, len(self.messageHead), self.blueskyMaxLength,
+                                  self.thread_overflow)
+        logger.debug("World_data is %s (wikitext)", Clipped(word_data))
+        return word_data
+
+    def _lexicon_word_data(self, word):
+        """word_data from the local lexicon, None when the page is not in the dump"""
+        entry = self.lexicon.get(word, self.language) if self.lexicon is not None else None
+        if entry is None:
+            return None
+        word_data = fit_word_data(lexicon_events(entry), self.site_url, len(self.messageHead), self.blueskyMaxLength,
+                                  self.thread_overflow)
+        logger.debug("World_data is %s (lexicon)", Clipped(word_data))
+        return word_data
+
+    @timed_stage("post_to_bluesky")
+    def post_to_bluesky(self, word_data, link_card=None, day=None):
+        """Post the word of a day (today by default), with a prefetched (title, thumbnail) link card if given"""
         logger.info("post_to_bluesky started")
+        if self.posted_words.seen(self.bluesky_handle, word_data['word']):
+            # Typically a fallback entry already posted in an earlier year
+            logger.warning("<%s> was already posted by %s, not posting it again",
+                           word_data['word'], self.bluesky_handle)
+            return False
         if not self.client:
             logger.error("No connection valid")
             if not self.connect_to_bluesky():
                 return False
 
         try:
-            # Use text builder to can add clickable links
-            logger.info(f"Connection valid, data is {word_data}")
-            url = word_data['url']
+            logger.debug("Connection valid, data is %s", Clipped(word_data))
+            self._send_post(self._prepare_post(word_data, link_card, day))
+            return True
+        except Exception as e:
+            return self._posting_failed(e)
+
+    def _prepare_post(self, word_data, link_card=None, day=None):
+        """Render the post of a day (today by default) and upload its thumbnail, everything short of sending it"""
+        url = word_data['url']
+
+        text_builder, description = self._build_post_text(word_data)
+
+        if link_card is None:
+            link_card = self.get_link_card(url)
+        title, img_data = link_card
+
+        thumb_blob = None
+        if img_data:
+            with get_metrics().span(self.name, "upload_blob"):
+                thumb_blob = upload_thumb(self.client, img_data, self.blob_cache)
+
+        return {"word": word_data['word'], "text": text_builder,
+                "embed": self._build_embed(url, title, description, thumb_blob),
+                "img_data": img_data, "replies": self._build_replies(word_data),
+                "day": day or clock.today()}
+
+    def _enqueue(self, post):
+        """Put a rendered post in the outbox, return its record key"""
+        # One record key per account, series and day: the outbox can retry without ever posting twice
+        rkey = post_rkey(post["day"], self.bluesky_handle, self.template_family)
+        self.outbox.enqueue(self.bluesky_handle, rkey, post["word"], post["text"], embed_dict(post["embed"]),
+                            post["img_data"], post["replies"])
+        return rkey
+
+    def _check_sent(self, post, rkey):
+        status = self.outbox.status(self.bluesky_handle, rkey)
+        if status != "sent":
+            raise PostNotSent(f"Post of <{post['word']}> is {status} in the outbox")
+
+    def _send_post(self, post):
+        rkey = self._enqueue(post)
+        with get_metrics().span(self.name, "send_post"):
+            self.drain_outbox()
+        self._check_sent(post, rkey)
+
+    def drain_outbox(self):
+        """Send this account's due posts, including those left by failed or rate-limited runs"""
+        if not self.outbox.due(self.bluesky_handle):
+            return 0
+        if not self.client and not self.connect_to_bluesky():
+            return 0
+        sent = self.outbox.drain(self.bluesky_handle, self.client, self.blob_cache)
+        for post in sent:
+            self._posted(post, self.client.me.did)
+        return len(sent)
+
+    def _posted(self, post, did):
+        """Bookkeeping once the outbox sent a post"""
+        self.posted_words.record(self.bluesky_handle, post["word"])
+        thumb_blob = post_thumb(post)
+        if thumb_blob is not None and post["image"]:
+            self.blob_cache.put(did, post["image"], thumb_blob)
+
+    def _posting_failed(self, e):
+        from atproto_client.exceptions import UnauthorizedError
+
+        logger.error("Error posting to Bluesky: %s", e)
+        if isinstance(e, UnauthorizedError):
+            # Session revoked: log in again on the next run
+            forget_bluesky_client(self.bluesky_handle)
+        return False
+
+    @timed_stage("warm_up")
+    @run_budget()
+    def warm_up(self, day=None):
+        """Get a run due shortly ready: DNS, pooled connections, a checked session and the rendered post"""
+        day = day or clock.today()
+        resolve_hosts([self.site_url, PDS_URL or "https://bsky.social"])
+        if not self.connect_to_bluesky():
+            return False
+        try:
+            # Any call refreshes the session if it is about to expire, and leaves a PDS connection open
+            call_with_retry(self.client.com.atproto.server.get_session, host=PDS_HOST)
+            if not self.posting:
+                return True
+
+            cached = self._load_prefetched(day)
+            if cached:
+                word_data, link_card = cached["word_data"], (cached["og_title"], cached["thumb"])
+            else:
+                word_data, link_card = self.get_word_data(self.get_today_word(day)), None
+                if not word_data:
+                    return False
+            if self.posted_words.seen(self.bluesky_handle, word_data['word']):
+                return False
 
-            text_builder = f"📚 Wiktionnaire - Le mot du jour est : \n\n{word_data['first_line'].capitalize()}\n"
-            for d in word_data['def_lines']:
-                text_builder += f"{d}\n"
+            self._prepared = (day, self._prepare_post(word_data, link_card, day))
+            logger.info("Post of <%s> ready for %s", word_data['word'], day.isoformat())
+            return True
+        except Exception as e:
+            logger.error("Warm-up failed: %s", e)
+            return False
 
-            logger.info(f"text_builder length is {str(len(text_builder))}")
-            logger.info(f"text_builder is {text_builder}")
+    def _take_prepared(self, day):
+        """The post prepared by warm_up for a day, if any; it is used once"""
+        prepared, self._prepared = self._prepared, None
+        if prepared is None or prepared[0] != day:
+            return None
+        logger.info("Using the post prepared for <%s>", prepared[1]['word'])
+        return prepared[1]
 
-            description = word_data['first_line'].split("—")[1].capitalize()
-            logger.info(f"description is {description}")
+    def _build_post_text(self, word_data):
+        """Render the post text and the link card description"""
+        # Use text builder to can add clickable links
+        text_builder = f"{self.messageHead}{word_data['first_line'].capitalize()}\n"
+        for d in word_data['def_lines']:
+            text_builder += f"{d}\n"
 
-            img_url, title = self.get_og_tags(url)
-            if title is None:
-                raise ValueError('Required Open Graph Protocol (OGP) tags not found')
+        logger.info("text_builder length is %d", len(text_builder))
+        logger.debug("text_builder is %s", Clipped(text_builder))
 
-            thumb_blob = None
-            if img_url:
-                # Download image from og:image url and upload it as a blob
-                img_data = httpx.get(img_url).content
-                thumb_blob = self.client.upload_blob(img_data).blob
-
-            # AppBskyEmbedExternal is the same as "link card" in the app
-            embed_external = models.AppBskyEmbedExternal.Main(
-                external=models.AppBskyEmbedExternal.External(title=title, description=f"{description}", uri=url,
-                                                              thumb=thumb_blob)
-            )
-            self.client.send_post(text=text_builder, embed=embed_external)
+        description = word_data['first_line'].split("—")[1].capitalize()
+        logger.info("description is %s", description)
 
-            return True
-        except Exception as e:
-            logger.error(f"Error posting to Bluesky: {e}")
-            return False
+        return text_builder, description
+
+    def _build_replies(self, word_data):
+        """Texts of the replies holding the definitions left out of the post, if any"""
+        return reply_texts(word_data.get("more_lines", []), self.blueskyMaxLength)
+
+    def _build_embed(self, url, title, description, thumb_blob):
+        """AppBskyEmbedExternal is the same as "link card" in the app"""
+        from atproto import models
+
+        return models.AppBskyEmbedExternal.Main(
+            external=models.AppBskyEmbedExternal.External(title=title, description=f"{description}", uri=url,
+                                                          thumb=thumb_blob)
+        )
 
     # Test link card
 
@@ -196,96 +387,265 @@ class WiktionaryBlueskyBot:
 
         return None
 
+    @timed_stage("get_link_card")
+    def get_link_card(self, url: str) -> t.Tuple[str, t.Optional[bytes]]:
+        """Return the OG title and the og:image bytes of a page"""
+        img_url, title = self.get_og_tags(url)
+        if title is None:
+            raise ValueError('Required Open Graph Protocol (OGP) tags not found')
+
+        img_data = None
+        if img_url:
+            # Download image from og:image url, it is uploaded as a blob when posting
+            try:
+                img_data = call_with_retry(download_image, self.http, img_url, host=host_of(img_url))
+            except Exception as e:
+                # A link card without a thumbnail beats no post at all
+                logger.error("Failed to download og:image %s: %s", img_url, e)
+        return title, img_data
+
     def get_og_tags(self, url: str) -> t.Tuple[t.Optional[str], t.Optional[str]]:
-        response = httpx.get(url)
-        response.raise_for_status()
+        # Only <head> is read, the article body can be far larger than the extract
+        return self._parse_og_tags(call_with_retry(fetch_html_head, self.http, url, host=host_of(url)))
 
-        og_tags = self._META_PATTERN.findall(response.text)
+    def _parse_og_tags(self, html: str) -> t.Tuple[t.Optional[str], t.Optional[str]]:
+        og_tags = self._META_PATTERN.findall(html)
 
         og_image = self._get_og_tag_value(og_tags, 'og:image')
         og_title = self._get_og_tag_value(og_tags, 'og:title')
 
         return og_image, og_title
 
-    def get_today_word(self):
-
-        current_day = datetime.now().day
-        current_month = datetime.now().month
-        current_year = datetime.now().year
-
-        page_name = f"Modèle:Entrée du jour/{current_year}/{current_month:02d}/{current_day:02d}"
-        logger.info(f"Page_name is {page_name}")
+    @timed_stage("get_today_word")
+    def get_today_word(self, day=None):
+        """Find the entry of a day (today by default), falling back to the same day in 2021, in one request"""
+        titles = day_entry_titles(self.template_family, day or clock.today())
+        logger.info("Candidate pages are %s", titles)
         try:
-            params = {
-                "action": "query",
-                "prop": "extracts",
-                "exsectionformat": "plain",
-                "titles": page_name,
-                "format": "json"
-            }
-
-            response = requests.get(self.api_url, params=params)
-            data = response.json()
-
-            page_id = next(iter(data["query"]["pages"]))
-
-            logger.info(f"page_id is {page_id}")
-            logger.info(f"data[query][pages][page_id] is {data["query"]["pages"][page_id]}")
-
-            if page_id == "-1" or "extract" not in data["query"]["pages"][page_id]:
-                # fallback
-                logger.info(f"Fail to found a page, look at 2021")
-                page_name = f"Modèle:Entrée du jour/2021/{current_month:02d}/{current_day:02d}"
-                params = {
-                    "action": "query",
-                    "prop": "extracts",
-                    "exsectionformat": "plain",
-                    "titles": page_name,
-                    "format": "json"
-                }
+            if self.lexicon is not None and self.lexicon.get(titles[0]):
+                # Nothing can take precedence over the preferred page, no need to ask the API
+                logger.info("page_name is <%s> (lexicon)", titles[0])
+                return titles[0]
 
-                response = requests.get(self.api_url, params=params)
-                data = response.json()
-
-                page_id = next(iter(data["query"]["pages"]))
-
-            if page_id != "-1" and "extract" in data["query"]["pages"][page_id]:
-                extract = data["query"]["pages"][page_id]["extract"]
+            response = get_with_retry(self.http, self.api_url, params=self._source_params(titles))
+            data = response.json()
 
-                logger.info(f"page_name is <{page_name}>")
+            page_name, extract = self._first_source(data, titles)
+            if page_name is not None:
+                # Keep the extract so that get_word_data does not fetch it again
+                self._day_extracts[page_name] = (extract, page_revision(data, page_name))
+                logger.info("page_name is <%s>", page_name)
                 return page_name
 
         except Exception as e:
-            logger.error(f"Error fetching random word: {e}")
-            time.sleep(2)  # Wait before retrying
+            logger.error("Error fetching random word: %s", e)
 
-        logger.error("Failed to get a suitable random word after multiple attempts")
+        logger.error("Failed to get a suitable word of the day")
         return None
 
 
-    def run(self):
-        """Main method to run the bot"""
-        logger.info("Starting Wiktionary Bluesky Bot")
-        
+    def _load_prefetched(self, day=None):
+        """A day's entry (today by default) from the prefetch cache, None on a miss"""
+        if self.prefetch_cache is None:
+            return None
+        cached = self.prefetch_cache.load(self.language, self.template_family, day or clock.today())
+        if cached:
+            logger.info("Using prefetched entry <%s>", cached['page_name'])
+        return cached
+
+    @timed_stage("run")
+    @run_budget()
+    def run(self, day=None):
+        """Main method to run the bot, for the entry of a day (today by default)"""
+        logger.info("Starting %s", self.name)
+        day = day or clock.today()
+
         try:
             # Connect to Bluesky
             if not self.connect_to_bluesky():
                 return False
-            
+
+            if not self.posting:
+                return self.get_word_data(self.get_today_word(day)) is not None
+
+            prepared = self._take_prepared(day)
+            if prepared:
+                try:
+                    self._send_post(prepared)
+                    return True
+                except Exception as e:
+                    return self._posting_failed(e)
+
+            cached = self._load_prefetched(day)
+            if cached:
+                return self.post_to_bluesky(cached["word_data"], (cached["og_title"], cached["thumb"]), day)
+
             # Get random word and definition
-            word_data = self.get_word_data(self.get_today_word())
+            word_data = self.get_word_data(self.get_today_word(day))
             if not word_data:
                 logger.error("Failed to get word data")
                 return False
             
             # Post to Bluesky
-            success = self.post_to_bluesky(word_data)
+            success = self.post_to_bluesky(word_data, day=day)
             
             return success
         except Exception as e:
-            logger.error(f"Error running bot: {e}")
+            logger.error("Error running bot: %s", e)
             return False
 
+    @timed_stage("connect")
+    async def _async_connect_to_bluesky(self):
+        """Async counterpart of connect_to_bluesky"""
+        try:
+            self.async_client = await async_call_with_retry(get_async_bluesky_client, self.bluesky_handle,
+                                                            self.bluesky_password, self.async_http, host=PDS_HOST)
+            logger.info("Connected to Bluesky as %s", self.bluesky_handle)
+            return True
+        except Exception as e:
+            logger.error("Failed to connect to Bluesky: %s", e)
+            return False
+
+    @timed_stage("get_word_data")
+    async def _async_get_word_data(self, day):
+        """Fetch and parse a day's entry in a single request"""
+        titles = day_entry_titles(self.template_family, day)
+        word_data = self._lexicon_word_data(titles[0])
+        if word_data:
+            return word_data
+        response = await async_get_with_retry(self.async_http, self.api_url, params=self._source_params(titles))
+        data = response.json()
+        page_name, extract = self._first_source(data, titles)
+        if page_name is None:
+            raise ValueError('Definition not found')
+        logger.info("page_name is <%s>", page_name)
+        key, revision = self._word_cache_key(page_name), page_revision(data, page_name)
+        word_data = self.word_cache.get(key, revision)
+        if word_data:
+            return word_data
+
+        try:
+            word_data = self._parse_extract(extract)
+        except ValueError:
+            word_data = None
+        if self._needs_full_extract(extract, word_data):
+            response = await async_get_with_retry(self.async_http, self.api_url,
+                                                  params=extract_params([page_name], narrow=False))
+            data = response.json()
+            _, extract = first_extract(data, [page_name])
+            if extract is None:
+                raise ValueError('Definition not found')
+            word_data = self._parse_extract(extract)
+            revision = page_revision(data, page_name)
+        if word_data:
+            self.word_cache.put(key, revision, word_data)
+        return word_data
+
+    @timed_stage("get_link_card")
+    async def _async_get_link_card(self, url):
+        """Fetch the OG title and thumbnail bytes of a page"""
+        html = await async_call_with_retry(async_fetch_html_head, self.async_http, url, host=host_of(url))
+        img_url, title = self._parse_og_tags(html)
+        if title is None:
+            raise ValueError('Required Open Graph Protocol (OGP) tags not found')
+
+        img_data = None
+        if img_url:
+            try:
+                img_data = await async_call_with_retry(async_download_image, self.async_http, img_url,
+                                                      host=host_of(img_url))
+            except Exception as e:
+                logger.error("Failed to download og:image %s: %s", img_url, e)
+        return title, img_data
+
+    async def _async_send_post(self, post):
+        rkey = self._enqueue(post)
+        with get_metrics().span(self.name, "send_post"):
+            sent = await self.outbox.async_drain(self.bluesky_handle, self.async_client, self.blob_cache)
+        for sent_post in sent:
+            self._posted(sent_post, self.async_client.me.did)
+        self._check_sent(post, rkey)
+
+    async def _async_pipeline(self, day):
+        if not self.posting:
+            try:
+                return await self._async_get_word_data(day) is not None
+            except Exception as e:
+                logger.error("Failed to get word data: %s", e)
+                return False
+
+        prepared = self._take_prepared(day)
+        if prepared:
+            if not await self._async_connect_to_bluesky():
+                return False
+            try:
+                await self._async_send_post(prepared)
+                return True
+            except Exception as e:
+                return self._posting_failed(e)
+
+        # The login only gates the upload, so it overlaps the Wiktionary work
+        login = asyncio.create_task(self._async_connect_to_bluesky())
+        try:
+            cached = self._load_prefetched(day)
+            if cached:
+                word_data = cached["word_data"]
+                title, img_data = cached["og_title"], cached["thumb"]
+            else:
+                word_data = await self._async_get_word_data(day)
+                title, img_data = await self._async_get_link_card(word_data['url'])
+            url = word_data['url']
+            text_builder, description = self._build_post_text(word_data)
+        except Exception as e:
+            logger.error("Failed to get word data: %s", e)
+            login.cancel()
+            return False
+
+        if self.posted_words.seen(self.bluesky_handle, word_data['word']):
+            logger.warning("<%s> was already posted by %s, not posting it again",
+                           word_data['word'], self.bluesky_handle)
+            login.cancel()
+            return False
+
+        if not await login:
+            return False
+
+        try:
+            thumb_blob = None
+            if img_data:
+                with get_metrics().span(self.name, "upload_blob"):
+                    thumb_blob = await async_upload_thumb(self.async_client, img_data, self.blob_cache)
+            await self._async_send_post({"word": word_data['word'], "text": text_builder,
+                                         "embed": self._build_embed(url, title, description, thumb_blob),
+                                         "img_data": img_data, "replies": self._build_replies(word_data),
+                                         "day": day})
+            return True
+        except Exception as e:
+            return self._posting_failed(e)
+
+    @timed_stage("run")
+    @run_budget()
+    async def run_async(self, day=None):
+        """Same as run, with independent stages running concurrently"""
+        logger.info("Starting %s (async)", self.name)
+        day = day or clock.today()
+
+        if self.async_http is not None:
+            return await self._async_pipeline(day)
+
+        async with build_async_http_client() as self.async_http:
+            try:
+                return await self._async_pipeline(day)
+            finally:
+                # The client dies with this pool
+                forget_bluesky_client(self.bluesky_handle, self.async_http)
+                self.async_http = None
+
 if __name__ == "__main__":
+    from oneshot import configure
+    configure("wiktionary_bot.log")
     bot = WiktionaryBlueskyBot()
-    bot.run()
+    if os.getenv("BOT_ASYNC") == "1":
+        asyncio.run(bot.run_async())
+    else:
+        bot.run()
@@ -0,0 +1,163 @@
+import os
+import re
+import logging
+import typing as t
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+# Year whose daily entries are used when the current year has none
+FALLBACK_YEAR = 2021
+
+# Characters asked of TextExtracts for a narrow extract (exchars is capped at 1200)
+NARROW_EXTRACT_CHARS = int(os.getenv("WIKTIONARY_EXTRACT_CHARS", "1200"))
+
+# Replication lag (seconds) above which the API should refuse us rather than add load
+MAXLAG = int(os.getenv("WIKTIONARY_MAXLAG", "5"))
+
+# Tags, and blanks, at the end of an HTML extract
+_CLOSING_TAGS = re.compile(r"(?:\s*</[^>]+>)*\s*$")
+
+
+def day_entry_titles(family: str, day: date, fallback_year: int = FALLBACK_YEAR) -> t.List[str]:
+    """Template titles for a day, in order of preference
+
+    A family without a namespace is a template of the French edition; other editions name theirs in full.
+    """
+    prefix = family if ":" in family else f"Modèle:{family}"
+    titles = [f"{prefix}/{day.year}/{day.month:02d}/{day.day:02d}"]
+    if day.year != fallback_year:
+        titles.append(f"{prefix}/{fallback_year}/{day.month:02d}/{day.day:02d}")
+    return titles
+
+
+def extract_params(titles: t.List[str], narrow: bool = True) -> t.Dict[str, t.Any]:
+    """One multi-title query returning the extract of every title
+
+    A narrow query only asks for the head of each page, which holds the first
+    definition list; needs_full_extract tells when the whole page is needed.
+    The page info comes along, with the revision the extract was made from.
+    Several titles are only asked for their intro: TextExtracts returns one
+    whole-page extract per request, not necessarily the first title's. Day
+    templates have no sections, so their intro is the whole entry.
+    """
+    params = {
+        "action": "query",
+        "prop": "extracts|info",
+        "exsectionformat": "plain",
+        "exlimit": len(titles),
+        "titles": "|".join(titles),
+        "redirects": 1,
+        "format": "json",
+        "formatversion": 2,
+        "maxlag": MAXLAG,
+    }
+    if len(titles) > 1:
+        params["exintro"] = 1
+    if narrow:
+        params["exchars"] = NARROW_EXTRACT_CHARS
+    return params
+
+
+def info_params(titles: t.List[str]) -> t.Dict[str, t.Any]:
+    """Page info only, enough to know the current revision of each title"""
+    return {
+        "action": "query",
+        "prop": "info",
+        "titles": "|".join(titles),
+        "redirects": 1,
+        "format": "json",
+        "formatversion": 2,
+        "maxlag": MAXLAG,
+    }
+
+
+def needs_full_extract(extract: str, word_data: t.Optional[t.Dict[str, t.Any]]) -> bool:
+    """True when a narrow extract may yield less than the full page would"""
+    if word_data is None:
+        # Typically no <ol> in the narrow extract
+        return True
+    if word_data["def_lines"][-1].endswith("[…]") and "more_lines" not in word_data:
+        # The post is already full, more text would not change it
+        return False
+    return is_truncated(extract)
+
+
+def is_truncated(extract: str) -> bool:
+    """True when TextExtracts cut the extract at exchars
+
+    exchars counts characters of text, not of markup, so the length of an HTML extract says little;
+    a cut extract ends with an ellipsis, before the tags closing it.
+    """
+    return _CLOSING_TAGS.sub("", extract).endswith("…")
+
+
+def _resolve_title(data: t.Dict[str, t.Any], title: str) -> str:
+    """Follow the normalization and redirects reported by the API"""
+    query = data.get("query", {})
+    for key in ("normalized", "redirects"):
+        for entry in query.get(key, []):
+            if entry["from"] == title:
+                title = entry["to"]
+    return title
+
+
+def first_extract(data: t.Dict[str, t.Any], titles: t.List[str]) -> t.Tuple[t.Optional[str], t.Optional[str]]:
+    """Return (title, extract) of the first title, in order, that has an extract"""
+    pages = {page["title"]: page for page in data.get("query", {}).get("pages", [])}
+    for title in titles:
+        page = pages.get(_resolve_title(data, title))
+        if page and not page.get("missing") and page.get("extract"):
+            return title, page["extract"]
+        logger.info("No extract for <%s>", title)
+    return None, None
+
+
+def page_revision(data: t.Dict[str, t.Any], title: str) -> t.Optional[int]:
+    """Current revision id of a title, None when the page is missing or the info was not asked"""
+    pages = {page["title"]: page for page in data.get("query", {}).get("pages", [])}
+    page = pages.get(_resolve_title(data, title))
+    if page is None or page.get("missing"):
+        return None
+    return page.get("lastrevid")
+
+
+def wikitext_params(titles: t.List[str], info: bool = False) -> t.Dict[str, t.Any]:
+    """One query returning the current wikitext of up to 50 titles
+
+    Unlike whole-page extracts, which TextExtracts returns one per request,
+    revision content comes back for every title of the batch. With info, the
+    page info comes along, with the revision the wikitext is from.
+    """
+    return {
+        "action": "query",
+        "prop": "revisions|info" if info else "revisions",
+        "rvprop": "content",
+        "rvslots": "main",
+        "titles": "|".join(titles),
+        "redirects": 1,
+        "format": "json",
+        "formatversion": 2,
+        "maxlag": MAXLAG,
+    }
+
+
+def page_wikitexts(data: t.Dict[str, t.Any], titles: t.List[str]) -> t.Dict[str, str]:
+    """Wikitext of each requested title that exists, keyed by the title as requested"""
+    pages = {page["title"]: page for page in data.get("query", {}).get("pages", [])}
+    wikitexts = {}
+    for title in titles:
+        page = pages.get(_resolve_title(data, title))
+        if page and not page.get("missing") and page.get("revisions"):
+            wikitexts[title] = page["revisions"][0]["slots"]["main"]["content"]
+    return wikitexts
+
+
+def first_wikitext(data: t.Dict[str, t.Any], titles: t.List[str]) -> t.Tuple[t.Optional[str], t.Optional[str]]:
+    """Return (title, wikitext) of the first title, in order, that exists"""
+    wikitexts = page_wikitexts(data, titles)
+    for title in titles:
+        if wikitexts.get(title):
+            return title, wikitexts[title]
+        logger.info("No wikitext for <%s>", title)
+    return None, None
@@ -0,0 +1,79 @@
+import os
+import json
+import logging
+import threading
+import typing as t
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+# Parsed pages kept, least recently used evicted first
+WORD_CACHE_SIZE = int(os.getenv("WORD_CACHE_SIZE", "256"))
+
+
+class WordDataCache:
+    """Parsed word_data by page and revision: an LRU in memory, written through to a JSON file"""
+
+    def __init__(self, path=None, max_entries: int = WORD_CACHE_SIZE):
+        self.path = path or os.path.join(DATA_DIR, "word_data_cache.json")
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, t.Dict[str, t.Any]]" = OrderedDict()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                # Stored from least to most recently used
+                self._entries.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error("Ignoring unreadable word data cache %s: %s", self.path, e)
+
+    def known(self, key: str) -> bool:
+        """True when some revision of the page is cached, i.e. a revision check may pay off"""
+        return key in self._entries
+
+    def get(self, key: str, revision: t.Optional[int]) -> t.Optional[t.Dict[str, t.Any]]:
+        """word_data parsed from this revision of the page, None if it was not, or the revision is unknown"""
+        if revision is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["revision"] != revision:
+                return None
+            self._entries.move_to_end(key)
+        logger.info("Reusing the word data parsed from revision %s of %s", revision, key)
+        return entry["word_data"]
+
+    def put(self, key: str, revision: t.Optional[int], word_data: t.Dict[str, t.Any]):
+        if revision is None:
+            return
+        with self._lock:
+            if self._entries.get(key) == {"revision": revision, "word_data": word_data}:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = {"revision": revision, "word_data": word_data}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                # Still cached for the life of the process
+                logger.error("Failed to write the word data cache: %s", e)
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_word_cache() -> WordDataCache:
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = WordDataCache()
+        return _default_cache